@@ -1,5 +1,6 @@
+import sys
 from Tabify.src.models.transcriber import Transcriber
 
-t = Transcriber('test.musicxml')
-tab = t.transcribe()
+t = Transcriber()
+tab = t.transcribe(sys.argv[1] if len(sys.argv) > 1 else 'test.musicxml')
 print(tab)
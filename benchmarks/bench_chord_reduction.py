@@ -0,0 +1,135 @@
+'''
+Compares Guitar.make_chord_playable against the music21 implementation it replaced on the chords of
+a dense piano reduction, checks that every reduced chord has a fingering, and times prepare_song on
+the same score with and without chord reduction.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_chord_reduction [num_events]
+'''
+import sys
+import time
+import numpy as np
+from Tabify.benchmarks.synthetic_scores import PIANO, generate_score
+from Tabify.src.models.chord import ChordTable
+from Tabify.src.models.fingering import NUM_FINGERS
+from Tabify.src.models.guitar import (Guitar, MAX_REACH, OCTAVE, ROOT, THIRD, SEVENTH, THIRTEENTH,
+                                      ELEVENTH, NINTH, FIFTH, midi_number)
+from Tabify.src.models.song import Song
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs
+
+def legacy_is_barreable(guitar, notes):
+    midi_notes = [midi_number(n) for n in notes]
+    for barre_pitches in guitar.index.fret_pitches[:guitar.num_frets]:
+        if len([n for n in midi_notes if n not in barre_pitches]) < NUM_FINGERS:
+            return True
+    return False
+
+def legacy_make_chord_playable(guitar, chord):
+    '''
+    The music21 make_chord_playable that preceded the bitmask one, kept as a reference. The only
+    change is iterating over the items of notes_by_name where it had iterated over its keys.
+    chord: a list of music21 Note objects, lowest first
+    '''
+    # pylint: disable=import-outside-toplevel
+    from music21.pitch import Pitch
+    from music21.interval import Interval
+    from music21.chord import Chord
+
+    notes_by_name = {}
+    for note in chord:
+        if note.name not in notes_by_name:
+            notes_by_name[note.name] = [note]
+        else:
+            notes_by_name[note.name] += [note]
+
+    bass_note = chord[0].name
+    high_note = chord[-1].name
+
+    chord_root = Chord(notes_by_name.keys()).root()
+    intervals = {int(Interval(chord_root, Pitch(p)).name[1:]): p for p in notes_by_name}
+    priority = [ROOT, THIRD, SEVENTH, THIRTEENTH, ELEVENTH, NINTH, FIFTH]
+    prioritized_notes = [bass_note, high_note] + [intervals[i]
+                                                  for i in priority
+                                                  if i in intervals
+                                                  and intervals[i] not in [bass_note, high_note]]
+
+    if len(notes_by_name) > guitar.num_strings:
+        notes_by_name = {k: v
+                         for k, v in notes_by_name.items()
+                         if k in prioritized_notes[:guitar.num_strings]}
+
+    new_chord = [chord[0]] + [notes_by_name[n][-1]
+                              for n in notes_by_name
+                              if notes_by_name[n][-1].name
+                              not in [bass_note, high_note]] + [chord[-1]]
+    max_interval = guitar.tuning_midi[-1] - guitar.tuning_midi[0] + MAX_REACH
+    chord_breadth = Interval(new_chord[0].pitch, new_chord[-1].pitch).semitones
+
+    if new_chord[0].pitch < guitar.lowest_pitch():
+        new_chord[0].pitch = new_chord[0].pitch.transpose(OCTAVE)
+        for note in new_chord[1:]:
+            if note.pitch < new_chord[0].pitch:
+                note.pitch = note.pitch.transpose(OCTAVE)
+    if chord_breadth > max_interval and midi_number(new_chord[0]) != guitar.tuning_midi[0]:
+        new_chord[-1].pitch = new_chord[-1].pitch.transpose(-OCTAVE)
+        for note in new_chord[::-1][:-1]:
+            if note.pitch > new_chord[-1].pitch:
+                note.pitch = note.pitch.transpose(-OCTAVE)
+
+    while not legacy_is_barreable(guitar, new_chord) and len(new_chord) > NUM_FINGERS:
+        new_chord = [n for n in new_chord if n.name in prioritized_notes[:len(new_chord)-1]]
+
+    return new_chord
+
+def time_legacy(guitar, chords):
+    from music21.note import Note # pylint: disable=import-outside-toplevel
+    notes = [[Note(midi = p) for p in chord] for chord in chords]
+    failures = 0
+    start = time.perf_counter()
+    for chord in notes:
+        try:
+            legacy_make_chord_playable(guitar, chord)
+        except (KeyError, IndexError, ValueError):
+            failures += 1
+    return time.perf_counter() - start, failures
+
+def time_bitmask(guitar, chords):
+    start = time.perf_counter()
+    reduced = [guitar.make_chord_playable(chord) for chord in chords]
+    return time.perf_counter() - start, reduced
+
+def time_prepare_song(events, reduce_chords):
+    transcriber = Transcriber(TranscriberConfigs(reduce_chords = reduce_chords))
+    start = time.perf_counter()
+    song = transcriber.prepare_song(events)
+    elapsed = time.perf_counter() - start
+    fingered = sum(1 for chord_id in song.chord_ids.tolist()
+                   if transcriber.saved_fingerings[chord_id])
+    return elapsed, fingered / len(song)
+
+def main(num_events = 20000):
+    guitar = Guitar()
+    events = generate_score(PIANO, num_events, guitar)
+    chord_table = ChordTable()
+    song = Song.from_events(events, chord_table)
+    chords = [chord_table[i] for i in np.unique(song.chord_ids).tolist()]
+    sizes = [len(chord) for chord in chords]
+
+    legacy_time, failures = time_legacy(guitar, chords)
+    bitmask_time, reduced = time_bitmask(guitar, chords)
+    print(f'chords: {len(song)}  unique: {len(chords)}  '
+          f'notes per chord: {np.mean(sizes):.1f} (max {max(sizes)})')
+    print(f'legacy:  {legacy_time / len(chords) * 1e6:9.1f} us/chord  ({failures} failed)')
+    unfingerable = [r for r in reduced if not guitar.get_fingerings(r)]
+    print(f'bitmask: {bitmask_time / len(chords) * 1e6:9.1f} us/chord  '
+          f'notes kept per chord: {np.mean([len(r) for r in reduced]):.1f}  '
+          f'without fingerings: {len(unfingerable)}')
+    assert not unfingerable, f'reduced chords without fingerings: {unfingerable[:10]}'
+
+    for reduce_chords in (False, True):
+        elapsed, fingered = time_prepare_song(events, reduce_chords)
+        print(f'prepare_song reduce_chords={reduce_chords!s:5}: {elapsed:8.3f}s  '
+              f'chords with fingerings: {fingered:6.1%}')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,103 @@
+'''
+Compares the backpointer optimizer used by Transcriber.evaluate_song against the original
+path-copying implementation on a synthetic score.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_evaluate_song [num_chords]
+'''
+import random
+import sys
+import time
+import tracemalloc
+from music21.pitch import Pitch
+from Tabify.src.models.score_reader import make_events
+from Tabify.src.models.transcriber import Transcriber
+
+VOICINGS = [
+    ['E2', 'B2', 'E3', 'G#3', 'B3', 'E4'],
+    ['A2', 'E3', 'A3', 'C#4', 'E4'],
+    ['D3', 'A3', 'D4', 'F#4'],
+    ['G2', 'B2', 'D3', 'G3', 'B3', 'G4'],
+    ['C3', 'E3', 'G3', 'C4', 'E4'],
+    ['F2', 'C3', 'F3', 'A3', 'C4', 'F4'],
+    ['B2', 'F#3', 'B3', 'D4', 'F#4'],
+    ['C3', 'E3', 'G3'],
+    ['A3', 'C4', 'E4'],
+]
+
+def legacy_evaluate_song(transcriber):
+    '''
+    The path-copying evaluate_song that preceded the Optimizer, kept as a reference. Chords with no
+    fingerings are skipped, as the Optimizer skips them, and get None in the path.
+    Returns: the chosen Fingering object (or None) for each chord of the song, like evaluate_song
+    '''
+    chord_ids = transcriber.song.chord_ids.tolist()
+    fingered = [i for i, chord_id in enumerate(chord_ids) if transcriber.saved_fingerings[chord_id]]
+    optimal_paths = []
+
+    for chord_id in (chord_ids[i] for i in fingered):
+        if not optimal_paths:
+            optimal_paths = [([f], transcriber.configs.stretch_weight * f.stretch_cost)
+                             for f
+                             in transcriber.saved_fingerings[chord_id]]
+            continue
+
+        new_optimal_paths = []
+        for fingering in transcriber.saved_fingerings[chord_id]:
+            new_optimal_path = ()
+            for path in optimal_paths:
+                new_path = (path[0] + [fingering],
+                            path[1] +
+                            transcriber.configs.transition_weight *
+                            path[0][-1].transition(fingering) +
+                            transcriber.configs.stretch_weight * fingering.stretch_cost)
+                if not new_optimal_path or new_path[1] < new_optimal_path[1]:
+                    new_optimal_path = new_path
+            new_optimal_paths.append(new_optimal_path)
+
+        optimal_paths = new_optimal_paths
+
+    path = [None] * len(chord_ids)
+    if optimal_paths:
+        for i, fingering in zip(fingered, min(optimal_paths, key = lambda p: p[1])[0]):
+            path[i] = fingering
+    return path
+
+def build_transcriber(num_chords, seed = 0):
+    rng = random.Random(seed)
+    voicings = [[Pitch(n).midi for n in voicing] for voicing in VOICINGS]
+    events = make_events([(float(offset), midi, 1.0)
+                          for offset in range(num_chords)
+                          for midi in rng.choice(voicings)])
+    transcriber = Transcriber()
+    transcriber.song = transcriber.prepare_song(events)
+    return transcriber
+
+def measure(func, *args):
+    '''
+    Times one call, then repeats it under tracemalloc (which slows it down) for the peak memory.
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(num_chords = 5000):
+    transcriber = build_transcriber(num_chords)
+
+    legacy_path, legacy_time, legacy_peak = measure(legacy_evaluate_song, transcriber)
+    path, elapsed, peak = measure(transcriber.evaluate_song)
+
+    print(f'chords: {num_chords}')
+    print(f'legacy:    {legacy_time:8.3f}s  peak {legacy_peak / 2**20:8.2f} MiB')
+    print(f'optimizer: {elapsed:8.3f}s  peak {peak / 2**20:8.2f} MiB')
+    # both paths have an entry for every chord, so they're compared chord by chord
+    assert len(legacy_path) == len(path) == num_chords
+    print(f'identical: {all(a is b for a, b in zip(legacy_path, path))}')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,55 @@
+'''
+Checks how long the command line takes to import, using python -X importtime, and that it doesn't
+load the GUI, PDF or music21 libraries, which are only needed by the GUI and by fallback parsing.
+Exits with a non-zero status if the budget is exceeded, so it can be run as a regression check.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_import_time [budget_ms] [runs]
+'''
+import subprocess
+import sys
+
+ENTRY_MODULE = 'Tabify.src.main'
+FORBIDDEN_MODULES = ('PyQt5', 'fitz', 'music21')
+BUDGET_MS = 400
+TOP_MODULES = 10
+
+def import_times(module):
+    '''
+    Imports the module in a fresh interpreter.
+    Returns: a dict of the cumulative import time of each module that was loaded, in microseconds
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output = True, text = True, check = True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: <self us> | <cumulative us> | <module, indented by nesting depth>
+        _, cumulative_us, name = line.split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+def main(budget_ms = BUDGET_MS, runs = 5):
+    # the first run warms up the bytecode and file system caches
+    import_times(ENTRY_MODULE)
+    samples = [import_times(ENTRY_MODULE) for _ in range(runs)]
+    best = min(samples, key = lambda t: t[ENTRY_MODULE])
+    total_ms = best[ENTRY_MODULE] / 1000
+
+    print(f'import {ENTRY_MODULE}: {total_ms:.1f} ms (best of {runs}, budget {budget_ms} ms)')
+    for name, cumulative_us in sorted(best.items(), key = lambda t: -t[1])[1:TOP_MODULES + 1]:
+        print(f'  {cumulative_us / 1000:8.1f} ms  {name}')
+
+    failures = []
+    if total_ms > budget_ms:
+        failures.append(f'over budget by {total_ms - budget_ms:.1f} ms')
+    loaded = sorted({name.split('.')[0] for name in best} & set(FORBIDDEN_MODULES))
+    if loaded:
+        failures.append(f'loads {", ".join(loaded)}')
+
+    for failure in failures:
+        print(f'FAILED: {failure}', file = sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
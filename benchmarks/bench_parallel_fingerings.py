@@ -0,0 +1,36 @@
+'''
+Times the fingerings stage of prepare_song with the chords spread over different numbers of worker
+processes, on a polyphonic synthetic score where nearly every chord is new, and checks that every
+run finds the same fingerings.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_parallel_fingerings [num_events] [workers ...]
+'''
+import os
+import sys
+from Tabify.benchmarks.synthetic_scores import POLYPHONY, generate_score
+from Tabify.src.models.fingering import pack_fingerings
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs
+
+def run(events, workers):
+    transcriber = Transcriber(TranscriberConfigs(workers = workers, profile = True))
+    transcriber.prepare_song(events)
+    fingerings = {transcriber.chord_table[i]: pack_fingerings(f)
+                  for i, f in transcriber.saved_fingerings.items()}
+    return transcriber.stats.stages['fingerings']['seconds'], fingerings
+
+def main(num_events = 50000, *worker_counts):
+    worker_counts = worker_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+    events = generate_score(POLYPHONY, num_events)
+
+    print(f'events: {num_events}  cpus: {os.cpu_count()}')
+    serial_time, serial_fingerings = None, None
+    for workers in worker_counts:
+        elapsed, fingerings = run(events, workers)
+        if serial_time is None:
+            serial_time, serial_fingerings = elapsed, fingerings
+        print(f'workers {workers:3}: {elapsed:8.3f}s  speedup {serial_time / elapsed:5.2f}x  '
+              f'chords {len(fingerings)}  identical {fingerings == serial_fingerings}')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,71 @@
+'''
+Times Transcriber.evaluate_song with and without reusing the solutions of repeated passages on
+synthetic scores, from pop and hymn material that repeats its verses and choruses to polyphony that
+never comes back the same way, and checks that the result is exactly the same either way. Seeded
+songs are also checked against the path-copying evaluate_song that preceded the Optimizer.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_repeats [num_events]
+'''
+import sys
+import time
+from Tabify.benchmarks.bench_evaluate_song import legacy_evaluate_song
+from Tabify.benchmarks.synthetic_scores import (HYMN, MELODY, POLYPHONY, POP, PROGRESSION,
+                                                generate_score)
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs
+
+STYLES = (POP, HYMN, PROGRESSION, POLYPHONY)
+LEGACY_STYLES = (MELODY, POLYPHONY, PROGRESSION)
+LEGACY_SEEDS = range(6)
+LEGACY_EVENTS = 1500
+
+def time_evaluate_song(events, min_repeat_length):
+    transcriber = Transcriber(TranscriberConfigs(min_repeat_length = min_repeat_length))
+    transcriber.song = transcriber.prepare_song(events)
+    # warm the transition cache, so that only the search itself is compared
+    transcriber.evaluate_song()
+    start = time.perf_counter()
+    path = transcriber.evaluate_song()
+    elapsed = time.perf_counter() - start
+    optimizer = transcriber.optimizer
+    return elapsed, path, optimizer.total_cost, optimizer.reused / max(1, len(path))
+
+def packed(path):
+    return [f and f.to_bytes() for f in path]
+
+def check_legacy():
+    '''
+    Returns: the (style, seed, min_repeat_length) of each seeded song whose path differs from the
+    one legacy_evaluate_song finds
+    '''
+    mismatches = []
+    for style in LEGACY_STYLES:
+        for seed in LEGACY_SEEDS:
+            events = generate_score(style, LEGACY_EVENTS, seed = seed)
+            for min_repeat_length in (0, TranscriberConfigs().min_repeat_length):
+                transcriber = Transcriber(TranscriberConfigs(min_repeat_length = min_repeat_length))
+                transcriber.song = transcriber.prepare_song(events)
+                path = transcriber.evaluate_song()
+                legacy_path = legacy_evaluate_song(transcriber)
+                assert len(path) == len(legacy_path)
+                if packed(path) != packed(legacy_path):
+                    mismatches.append((style, seed, min_repeat_length))
+    return mismatches
+
+def main(num_events = 50000):
+    mismatches = check_legacy()
+    print(f'legacy check: {len(LEGACY_STYLES) * len(LEGACY_SEEDS)} songs, '
+          f'mismatches {mismatches}')
+    print(f'events: {num_events}')
+    for style in STYLES:
+        events = generate_score(style, num_events)
+        plain_time, plain_path, plain_cost, _ = time_evaluate_song(events, 0)
+        reused_time, reused_path, reused_cost, reused = time_evaluate_song(
+            events, TranscriberConfigs().min_repeat_length)
+        identical = reused_cost == plain_cost and packed(reused_path) == packed(plain_path)
+        print(f'{style:12} plain {plain_time:7.3f}s  reused {reused_time:7.3f}s  '
+              f'speedup {plain_time / reused_time:5.2f}x  chords reused {reused:6.1%}  '
+              f'identical {identical}')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
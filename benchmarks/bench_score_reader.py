@@ -0,0 +1,62 @@
+'''
+Compares the fast MusicXML and MIDI readers against parsing the same files with music21.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_score_reader [num_chords]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from music21 import chord, note, stream
+from Tabify.src.models.score_reader import read_score, read_music21
+
+def write_score(directory, num_chords, seed = 0):
+    '''
+    Writes a seeded random score of chords and single notes as MusicXML and MIDI.
+    Returns: the paths of the two files
+    '''
+    rng = random.Random(seed)
+    song = stream.Stream()
+    for _ in range(num_chords):
+        root = rng.randint(45, 65)
+        if rng.random() < 0.5:
+            song.append(chord.Chord([root, root + 4, root + 7], quarterLength = 1))
+        else:
+            song.append(note.Note(root + 12, quarterLength = 0.5))
+
+    musicxml_file = os.path.join(directory, 'bench.musicxml')
+    midi_file = os.path.join(directory, 'bench.mid')
+    song.write('musicxml', musicxml_file)
+    song.write('midi', midi_file)
+    return musicxml_file, midi_file
+
+def measure(func, *args):
+    '''
+    Times one call, then repeats it under tracemalloc (which slows it down) for the peak memory.
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(num_chords = 5000):
+    with tempfile.TemporaryDirectory() as directory:
+        for input_file in write_score(directory, num_chords):
+            events, elapsed, peak = measure(read_score, input_file)
+            m21_events, m21_elapsed, m21_peak = measure(read_music21, input_file)
+
+            print(os.path.basename(input_file))
+            print(f'  music21: {m21_elapsed:8.3f}s  peak {m21_peak / 2**20:8.2f} MiB  '
+                  f'{len(m21_events)} notes')
+            print(f'  fast:    {elapsed:8.3f}s  peak {peak / 2**20:8.2f} MiB  '
+                  f'{len(events)} notes')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,208 @@
+'''
+Times each stage of a transcription separately and end to end on synthetic scores of several styles,
+sizes and tunings, and prints how each stage scales with the size of the score. The results can be
+saved as JSON and compared against the results of another commit.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_suite [--sizes 100 1000 10000] [--json results.json]
+                                            [--compare baseline.json]
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from Tabify.benchmarks.synthetic_scores import (STYLES, TUNINGS, generate_score, make_guitar,
+                                                write_midi)
+from Tabify.src.models.chord import ChordTable
+from Tabify.src.models.fingering import Fingering
+from Tabify.src.models.song import Song
+from Tabify.src.models.tab import Tab
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs
+
+STAGES = ('get_fingerings', 'try_add_position', 'prepare_song', 'evaluate_song', 'tab_str',
+          'end_to_end')
+RESULTS_VERSION = 1
+
+def best_time(repeats, setup, run):
+    '''
+    Calls setup() then times run(state) on what it returns, repeats times.
+    Returns: the fastest time and the result of the last run
+    '''
+    best = None
+    for _ in range(repeats):
+        state = setup()
+        start = time.perf_counter()
+        result = run(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def placements(fingerings):
+    '''
+    Returns: the (finger, position) steps that build each of the fingerings, for replaying them
+    with try_add_position
+    '''
+    steps = []
+    for fingering in fingerings:
+        steps.append([(fingering.string_fingers[string] or None, (fingering.frets[string], string))
+                      for fret, string in fingering.get_all_positions()])
+    return steps
+
+def replay(steps):
+    added = 0
+    for fingering_steps in steps:
+        fingering = Fingering()
+        for finger, position in fingering_steps:
+            added += fingering.try_add_position(finger, position)
+    return added
+
+def bench_score(events, tuning_name, repeats, directory):
+    '''
+    Times every stage on one score.
+    Returns: a dict of the time and work count of each stage
+    '''
+    tuning, num_strings = TUNINGS[tuning_name]
+    results = {}
+
+    def fresh_transcriber():
+        # the guitar in the configs keeps its chord shapes, so each run gets new configs
+        return Transcriber(TranscriberConfigs(tuning, num_strings))
+
+    transpose_steps = fresh_transcriber().get_transposition(events)
+    song = Song.from_events(events, ChordTable(), transpose_steps)
+    unique_chords = [song.chord_table[i] for i in np.unique(song.chord_ids).tolist()]
+    elapsed, fingerings = best_time(
+        repeats, lambda: make_guitar(tuning_name),
+        lambda guitar: [f for chord in unique_chords for f in guitar.get_fingerings(chord)])
+    results['get_fingerings'] = (elapsed, len(unique_chords))
+
+    steps = placements(fingerings)
+    elapsed, added = best_time(repeats, lambda: steps, replay)
+    results['try_add_position'] = (elapsed, added)
+
+    def prepare(transcriber):
+        transcriber.song = transcriber.prepare_song(events)
+        return transcriber
+
+    elapsed, transcriber = best_time(repeats, fresh_transcriber, prepare)
+    results['prepare_song'] = (elapsed, len(transcriber.song))
+
+    elapsed, path = best_time(repeats, lambda: transcriber, lambda t: t.evaluate_song())
+    results['evaluate_song'] = (elapsed, len(path))
+
+    elapsed, text = best_time(repeats, lambda: Tab(path, transcriber.configs.guitar), str)
+    results['tab_str'] = (elapsed, len(text))
+
+    midi_file = os.path.join(directory, 'score.mid')
+    write_midi(events, midi_file)
+    elapsed, text = best_time(repeats, fresh_transcriber, lambda t: str(t.transcribe(midi_file)))
+    results['end_to_end'] = (elapsed, len(text))
+    return results
+
+def scaling_exponent(sizes, times):
+    '''
+    Returns: the slope of log(time) against log(size), e.g. 1 for a stage that scales linearly
+    '''
+    points = [(s, t) for s, t in zip(sizes, times) if t > 0]
+    if len(points) < 2:
+        return None
+    x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+    return float(np.polyfit(x, y, 1)[0])
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                                text = True, check = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+def run_suite(styles, tunings, sizes, repeats, seed):
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        for tuning_name in tunings:
+            guitar = make_guitar(tuning_name)
+            for style in styles:
+                for size in sizes:
+                    events = generate_score(style, size, guitar, seed)
+                    for stage, (elapsed, count) in bench_score(events, tuning_name, repeats,
+                                                               directory).items():
+                        records.append({'tuning': tuning_name, 'style': style, 'events': size,
+                                        'stage': stage, 'seconds': elapsed, 'count': count})
+                    print(f'{tuning_name:>12} {style:>11} {size:>7}: ' +
+                          ' '.join(f'{r["stage"]} {r["seconds"]:.3f}s'
+                                   for r in records[-len(STAGES):]),
+                          file = sys.stderr, flush = True)
+
+    scaling = []
+    for tuning_name in tunings:
+        for style in styles:
+            for stage in STAGES:
+                rows = sorted((r['events'], r['seconds']) for r in records
+                              if (r['tuning'], r['style'], r['stage']) == (tuning_name, style, stage))
+                scaling.append({'tuning': tuning_name, 'style': style, 'stage': stage,
+                                'exponent': scaling_exponent(*zip(*rows))})
+
+    return {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'repeats': repeats,
+        'results': records,
+        'scaling': scaling
+    }
+
+def print_scaling(report):
+    print(f'{"tuning":>12} {"style":>11} ' + ' '.join(f'{s:>16}' for s in STAGES))
+    curves = {}
+    for row in report['scaling']:
+        curves.setdefault((row['tuning'], row['style']), {})[row['stage']] = row['exponent']
+    for (tuning_name, style), exponents in curves.items():
+        cells = ['n/a' if exponents[s] is None else f'n^{exponents[s]:.2f}' for s in STAGES]
+        print(f'{tuning_name:>12} {style:>11} ' + ' '.join(f'{c:>16}' for c in cells))
+
+def compare(report, baseline):
+    '''
+    Prints how long each stage took relative to the same stage in the baseline results.
+    '''
+    def key(r):
+        return r['tuning'], r['style'], r['events'], r['stage']
+
+    before = {key(r): r['seconds'] for r in baseline['results']}
+    print(f'compared with {baseline.get("commit")}: time / baseline time')
+    for record in report['results']:
+        if key(record) in before and before[key(record)] > 0:
+            ratio = record['seconds'] / before[key(record)]
+            print(f'{record["tuning"]:>12} {record["style"]:>11} {record["events"]:>7} '
+                  f'{record["stage"]:>16} {ratio:7.2f}x')
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [100, 1000, 10000])
+    parser.add_argument('--styles', nargs = '+', choices = STYLES, default = list(STYLES))
+    parser.add_argument('--tunings', nargs = '+', choices = list(TUNINGS), default = list(TUNINGS))
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--json', help = 'write the results to this file')
+    parser.add_argument('--compare', help = 'a results file from an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.styles, args.tunings, sorted(args.sizes), args.repeats, args.seed)
+    print_scaling(report)
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(report, results_file, indent = 1)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(report, json.load(baseline_file))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
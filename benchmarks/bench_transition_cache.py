@@ -0,0 +1,51 @@
+'''
+Times Transcriber.evaluate_song with and without the transition cache on synthetic scores, from
+heavily repeating pop and hymn material to polyphony where almost no pair of chords comes back, in
+both the exact search and a beam search, and checks that the cache doesn't change the result. Each
+time is the best of a few runs, so that one slow run doesn't decide the comparison.
+Run from the directory containing the Tabify checkout:
+    python -m Tabify.benchmarks.bench_transition_cache [num_events] [repeats]
+'''
+import sys
+import time
+from Tabify.benchmarks.synthetic_scores import HYMN, POLYPHONY, POP, PROGRESSION, generate_score
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs, BEAM_SEARCH, EXACT_SEARCH
+
+STYLES = (POP, HYMN, PROGRESSION, POLYPHONY)
+SEARCHES = ((EXACT_SEARCH, None), (BEAM_SEARCH, 8))
+
+def time_evaluate_song(events, transition_cache_size, search, beam_width, repeats):
+    '''
+    Returns: the best time of the repeats, each with a new cache, and the path, cost and cache
+    stats of the last one
+    '''
+    best = None
+    for _ in range(repeats):
+        transcriber = Transcriber(TranscriberConfigs(transition_cache_size = transition_cache_size,
+                                                     search = search, beam_width = beam_width))
+        transcriber.song = transcriber.prepare_song(events)
+        start = time.perf_counter()
+        path = transcriber.evaluate_song()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, path, transcriber.optimizer.total_cost, transcriber.transition_cache.stats()
+
+def main(num_events = 50000, repeats = 3):
+    print(f'events: {num_events}  best of {repeats}')
+    for search, beam_width in SEARCHES:
+        for style in STYLES:
+            events = generate_score(style, num_events)
+            uncached_time, uncached_path, uncached_cost, _ = time_evaluate_song(
+                events, 0, search, beam_width, repeats)
+            cached_time, cached_path, cached_cost, stats = time_evaluate_song(
+                events, TranscriberConfigs().transition_cache_size, search, beam_width, repeats)
+            identical = (cached_cost == uncached_cost and
+                         [f and f.to_bytes() for f in cached_path] ==
+                         [f and f.to_bytes() for f in uncached_path])
+            print(f'{search:6} {style:12} uncached {uncached_time:7.3f}s  '
+                  f'cached {cached_time:7.3f}s  speedup {uncached_time / cached_time:5.2f}x  '
+                  f'hit rate {stats["hit_rate"]:6.1%}  identical {identical}')
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,225 @@
+'''
+Seeded generators of synthetic scores for the benchmarks. Every score is a NOTE_EVENT array, the same
+form read_score returns, and can be written out as a Standard MIDI file to benchmark whole runs.
+'''
+import random
+from Tabify.src.models.guitar import Guitar, TUNINGS
+from Tabify.src.models.score_reader import make_events
+
+MELODY = 'melody'
+PROGRESSION = 'progression'
+POLYPHONY = 'polyphony'
+PIANO = 'piano'
+POP = 'pop'
+HYMN = 'hymn'
+STYLES = (MELODY, PROGRESSION, POLYPHONY, PIANO, POP, HYMN)
+
+MAJOR_SCALE = [0, 2, 4, 5, 7, 9, 11]
+# scale degrees of the chords, with their extensions when sevenths are added
+PROGRESSIONS = [[0, 4, 5, 3], [0, 5, 3, 4], [1, 4, 0, 0], [0, 3, 4, 4], [5, 3, 0, 4]]
+MIDI_DIVISION = 480
+
+def make_guitar(tuning_name, num_frets = 15):
+    tuning, num_strings = TUNINGS[tuning_name]
+    return Guitar(tuning, num_frets, num_strings)
+
+def playable_range(guitar):
+    '''
+    Returns: the lowest and highest MIDI numbers the guitar can play
+    '''
+    return min(guitar.tuning_midi), max(guitar.tuning_midi) + guitar.num_frets
+
+def scale_pitch(tonic, degree):
+    octave, step = divmod(degree, len(MAJOR_SCALE))
+    return tonic + 12 * octave + MAJOR_SCALE[step]
+
+def melody(rng, num_events, low, high):
+    '''
+    A single line moving mostly by step, with the occasional leap.
+    '''
+    tonic = rng.randint(low, low + 11)
+    top = 0
+    while scale_pitch(tonic, top + 1) <= high:
+        top += 1
+    degree = rng.randint(0, top)
+    offset = 0.0
+    rows = []
+    while len(rows) < num_events:
+        step = rng.choice([-1, -1, 1, 1, -2, 2, 0]) if rng.random() < 0.85 else rng.randint(-5, 5)
+        degree = min(max(degree + step, 0), top)
+        duration = rng.choice([0.5, 0.5, 1.0, 0.25])
+        rows.append((offset, scale_pitch(tonic, degree), duration))
+        offset += duration
+    return rows
+
+def progression(rng, num_events, low, high):
+    '''
+    Diatonic chord progressions voiced as block chords of three to six notes, with a bass note under
+    each and sevenths added now and then.
+    '''
+    tonic = rng.randint(low, low + 11)
+    offset = 0.0
+    rows = []
+    while len(rows) < num_events:
+        for degree in rng.choice(PROGRESSIONS):
+            size = rng.randint(3, 6)
+            root = scale_pitch(tonic, degree)
+            chord = [root, scale_pitch(tonic, degree + 2), scale_pitch(tonic, degree + 4)]
+            if rng.random() < 0.3:
+                chord.append(scale_pitch(tonic, degree + 6))
+            while len(chord) < size:
+                chord.append(chord[len(chord) - 3] + 12)
+            chord = [p for p in chord if p <= high]
+            duration = rng.choice([1.0, 2.0])
+            rows.extend((offset, p, duration) for p in sorted(set(chord)))
+            offset += duration
+    return rows[:num_events]
+
+def polyphony(rng, num_events, low, high):
+    '''
+    Three to five independent voices in separate registers, each with its own rhythm, so that nearly
+    every onset makes a new combination of pitches.
+    '''
+    num_voices = rng.randint(3, 5)
+    span = (high - low) // num_voices
+    voices = []
+    for voice in range(num_voices):
+        voice_low = low + voice * span
+        voices.append((voice_low, voice_low + span, rng.randint(voice_low, voice_low + span), 0.0))
+
+    rows = []
+    while len(rows) < num_events:
+        voice = min(range(num_voices), key = lambda v: voices[v][3])
+        voice_low, voice_high, pitch, offset = voices[voice]
+        pitch = min(max(pitch + rng.randint(-3, 3), voice_low), voice_high)
+        duration = rng.choice([0.25, 0.5, 0.5, 1.0])
+        rows.append((offset, pitch, duration))
+        voices[voice] = (voice_low, voice_high, pitch, offset + duration)
+    return rows
+
+def piano(rng, num_events, low, high):
+    '''
+    A dense piano reduction: a bass note and its octave or fifth in the left hand under an extended
+    chord of four to seven notes in the right, spread over the whole range, so most chords have more
+    notes than the guitar has strings.
+    '''
+    tonic = rng.randint(low, low + 11)
+    offset = 0.0
+    rows = []
+    while len(rows) < num_events:
+        for degree in rng.choice(PROGRESSIONS):
+            root = scale_pitch(tonic, degree)
+            chord = {root, root + rng.choice([7, 12])}
+            # stacked thirds from the root up to the thirteenth, an octave or two above the bass
+            right_octave = 12 * rng.randint(1, 2)
+            for third in range(rng.randint(4, 7)):
+                chord.add(scale_pitch(tonic, degree + 2 * third) + right_octave)
+            chord = sorted(p for p in chord if low <= p <= high)
+            duration = rng.choice([0.5, 1.0, 1.0, 2.0])
+            rows.extend((offset, p, duration) for p in chord)
+            offset += duration
+    return rows[:num_events]
+
+def voice_chord(tonic, degree, size, low):
+    '''
+    Returns: a close voicing of the diatonic chord on the degree, from its root above low upwards
+    '''
+    root = scale_pitch(tonic, degree)
+    while root - 12 >= low:
+        root -= 12
+    while root < low:
+        root += 12
+    return [scale_pitch(tonic, degree + 2 * third) + root - scale_pitch(tonic, degree)
+            for third in range(size)]
+
+def pop(rng, num_events, low, high):
+    '''
+    A verse and a chorus, each a four-chord loop strummed on every beat with the same melody note on
+    top each time round, alternating until the song is long enough. Nearly every pair of chords
+    has been heard before.
+    '''
+    tonic = rng.randint(low, low + 11)
+    sections = []
+    for _ in range(2):
+        loop = []
+        for degree in rng.choice(PROGRESSIONS):
+            chord = voice_chord(tonic, degree, rng.randint(3, 4), low + 7)
+            for _ in range(4):
+                loop.append(chord + [min(high, max(chord) + rng.choice([2, 3, 4, 5, 7]))])
+        sections.append(loop * 4)
+
+    offset = 0.0
+    rows = []
+    while len(rows) < num_events:
+        for section in sections:
+            for chord in section:
+                rows.extend((offset, p, 1.0) for p in sorted(set(chord)))
+                offset += 1.0
+    return rows[:num_events]
+
+def hymn(rng, num_events, low, high):
+    '''
+    A verse of four-part chords, mostly on the primary triads, sung again and again.
+    '''
+    tonic = rng.randint(low, low + 11)
+    verse = []
+    for _ in range(rng.randint(16, 32)):
+        degree = rng.choice([0, 0, 3, 4, 4, 5, 1])
+        bass, *upper = voice_chord(tonic, degree, 3, low)
+        verse.append(sorted({bass, *(min(high, p + 12) for p in upper), min(high, bass + 24)}))
+
+    offset = 0.0
+    rows = []
+    while len(rows) < num_events:
+        for chord in verse:
+            rows.extend((offset, p, 1.0) for p in chord)
+            offset += 1.0
+    return rows[:num_events]
+
+GENERATORS = {MELODY: melody, PROGRESSION: progression, POLYPHONY: polyphony, PIANO: piano,
+              POP: pop, HYMN: hymn}
+
+def generate_score(style, num_events, guitar = None, seed = 0):
+    '''
+    Generates a synthetic score that fits on the guitar.
+    style: one of STYLES
+    num_events: the number of notes in the score
+    guitar: the Guitar whose range the notes are kept in; the standard guitar by default
+    Returns: an array of NOTE_EVENT records in order of offset
+    '''
+    low, high = playable_range(guitar or Guitar())
+    rng = random.Random(f'{style}-{num_events}-{seed}')
+    return make_events(GENERATORS[style](rng, num_events, low, high))
+
+def write_midi(events, output_file):
+    '''
+    Writes the events as a single-track Standard MIDI file.
+    '''
+    messages = []
+    for offset, midi, duration in events.tolist():
+        start = round(offset * MIDI_DIVISION)
+        end = start + max(1, round(duration * MIDI_DIVISION))
+        messages.append((start, 1, bytes([0x90, midi, 80])))
+        messages.append((end, 0, bytes([0x80, midi, 0])))
+    # note-offs go before note-ons at the same tick, so repeated notes don't cut each other off
+    messages.sort(key = lambda m: m[:2])
+
+    track = bytearray()
+    tick = 0
+    for message_tick, _, message in messages:
+        track += variable_length(message_tick - tick) + message
+        tick = message_tick
+    track += b'\x00\xff\x2f\x00'
+
+    with open(output_file, 'wb') as midi_file:
+        midi_file.write(b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big')
+                        + (1).to_bytes(2, 'big') + MIDI_DIVISION.to_bytes(2, 'big'))
+        midi_file.write(b'MTrk' + len(track).to_bytes(4, 'big') + track)
+
+def variable_length(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
@@ -10,7 +10,7 @@ def main():
     Main function of the application. Initializes the QApplication.
     '''
     tabify = Tabify(sys.argv)
-    tabify.run()
+    sys.exit(tabify.run())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,153 @@
+'''
+Defines the BatchTranscriber class, which transcribes many sheet music files at once over a pool of
+worker processes.
+'''
+import glob
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Tabify.src.models.stats import stage
+from Tabify.src.models.transcriber import Transcriber
+
+SCORE_EXTENSIONS = ('.musicxml', '.mxl', '.xml', '.mid', '.midi')
+TAB_EXTENSION = '.tab.txt'
+
+# each worker process keeps one Transcriber so its saved fingerings carry over between files
+_worker_transcriber = None
+
+def find_input_files(patterns):
+    '''
+    Expands a list of file names, directories and glob patterns into the score files they name.
+    Directories are searched recursively for files with one of the SCORE_EXTENSIONS.
+    Returns: a sorted list of file names without duplicates
+    '''
+    input_files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive = True) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    input_files.update(os.path.join(root, f)
+                                       for f in files
+                                       if f.lower().endswith(SCORE_EXTENSIONS))
+            else:
+                input_files.add(match)
+    return sorted(input_files)
+
+def get_output_file(input_file, output_dir = None, input_dir = None):
+    '''
+    input_dir: the directory every input file is under, whose layout is copied into the output
+    directory; the input file's own directory by default
+    Returns: where the tab for the input file is written; next to it unless an output directory
+    is given
+    '''
+    base_name = os.path.splitext(os.path.basename(input_file))[0] + TAB_EXTENSION
+    if output_dir is None:
+        return os.path.join(os.path.dirname(input_file), base_name)
+    input_file_dir = os.path.dirname(os.path.abspath(input_file))
+    relative_dir = os.path.relpath(input_file_dir, os.path.abspath(input_dir or input_file_dir))
+    return os.path.normpath(os.path.join(output_dir, relative_dir, base_name))
+
+def get_output_files(input_files, output_dir = None):
+    '''
+    Returns: the output file of each input file, with the folders the inputs are in copied under
+    the output directory so that files of the same name in different folders don't overwrite
+    each other
+    '''
+    input_dir = None
+    if output_dir is not None and input_files:
+        input_dir = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in input_files])
+    return [get_output_file(f, output_dir, input_dir) for f in input_files]
+
+def _init_worker(configs):
+    global _worker_transcriber
+    _worker_transcriber = Transcriber(configs)
+
+def _transcribe_file(input_file, output_file):
+    '''
+    Transcribes one file in a worker process.
+    Returns: a BatchResult
+    '''
+    start = time.perf_counter()
+    error = None
+    try:
+        tab = _worker_transcriber.transcribe(input_file)
+        with stage(_worker_transcriber.stats, 'render'):
+            with open(output_file, 'w') as tab_file:
+                tab.write(tab_file)
+    except Exception as e: # pylint: disable=broad-except
+        error = repr(e)
+    finally:
+        # pool workers exit without running cleanup, so the cache is closed after every file
+        _worker_transcriber.close()
+    stats = _worker_transcriber.stats
+    return BatchResult(input_file, output_file, time.perf_counter() - start, error,
+                       None if stats is None else (os.getpid(), stats.as_dict()))
+
+class BatchResult:
+    '''
+    The outcome of transcribing one file in a batch.
+    elapsed: the time taken, in seconds
+    error: a description of what went wrong, or None if the transcription succeeded
+    stats: if the configs ask for profiling, the process id of the worker and the profile it has
+    collected over every file it has transcribed so far, as returned by Stats.as_dict()
+    '''
+    def __init__(self, input_file, output_file, elapsed, error = None, stats = None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.elapsed = elapsed
+        self.error = error
+        self.stats = stats
+
+    def __str__(self):
+        if self.error is not None:
+            return f'FAILED {self.input_file} ({self.elapsed:.2f}s): {self.error}'
+        return f'ok     {self.input_file} -> {self.output_file} ({self.elapsed:.2f}s)'
+
+class BatchTranscriber:
+    '''
+    Transcribes a list of files, spreading them over a pool of worker processes.
+    configs: the TranscriberConfigs shared by every file
+    jobs: the number of worker processes; 1 transcribes the files in this process
+    '''
+    def __init__(self, configs, jobs = 1):
+        self.configs = configs
+        self.jobs = max(1, jobs)
+
+    def run(self, input_files, output_dir = None):
+        '''
+        Transcribes the files, yielding a BatchResult for each one as soon as it finishes. A failed
+        file is reported in its result and doesn't stop the rest of the batch. Files that would be
+        written to the same tab, such as song.mid and song.musicxml in one folder, all fail rather
+        than overwrite each other.
+        '''
+        output_files = get_output_files(input_files, output_dir)
+        uses = Counter(output_files)
+        jobs = []
+        for input_file, output_file in zip(input_files, output_files):
+            if uses[output_file] > 1:
+                yield BatchResult(input_file, output_file, 0.0,
+                                  f'{uses[output_file] - 1} other input file(s) would also be '
+                                  f'written to {output_file}')
+                continue
+            if output_dir is not None:
+                os.makedirs(os.path.dirname(output_file), exist_ok = True)
+            jobs.append((input_file, output_file))
+
+        if self.jobs == 1:
+            _init_worker(self.configs)
+            for input_file, output_file in jobs:
+                yield _transcribe_file(input_file, output_file)
+            return
+
+        with ProcessPoolExecutor(max_workers = self.jobs,
+                                 initializer = _init_worker,
+                                 initargs = (self.configs,)) as executor:
+            futures = {executor.submit(_transcribe_file, *job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e: # pylint: disable=broad-except
+                    # the worker itself died, so there's no timing to report
+                    yield BatchResult(*futures[future], 0.0, repr(e))
@@ -1,6 +1,25 @@
-class Chord:
-    def __init__(self, notes):
-        self.notes = notes
+class ChordTable:
+    '''
+    Interns chords, giving each distinct set of pitches a small integer id.
+    chords: the sorted MIDI numbers of each chord, indexed by id
+    '''
+    def __init__(self):
+        self.chords = []
+        self.ids = {}
 
-    def __str__(self):
-        return ' '.join([n.nameWithOctave for n in self.notes])
+    def intern(self, pitches):
+        '''
+        Returns: the id of the chord with these MIDI numbers, adding it to the table if it's new
+        '''
+        key = tuple(sorted(pitches))
+        chord_id = self.ids.get(key)
+        if chord_id is None:
+            chord_id = self.ids[key] = len(self.chords)
+            self.chords.append(key)
+        return chord_id
+
+    def __getitem__(self, chord_id):
+        return self.chords[chord_id]
+
+    def __len__(self):
+        return len(self.chords)
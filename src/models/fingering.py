@@ -3,6 +3,7 @@ This module contains the Fingering class which is essential for representing
 guitar chords.
 '''
 
+from array import array
 from math import sqrt
 
 FRET = 0
@@ -12,86 +13,241 @@ NUM_FINGERS = 4
 OPEN = [None]
 HAND = range(1, NUM_FINGERS + 1)
 
+MAX_STRINGS = 8
+UNUSED = -1
+OPEN_FINGER = 0
+FINGERING_SIZE = 2 * MAX_STRINGS
+
+# the constraints a position can break when it's added to a fingering
+STRING_IN_USE = 'string_in_use'
+OPEN_UNDER_BARRE = 'open_under_barre'
+FINGER_IN_USE = 'finger_in_use'
+BARRE_OVER_OPEN = 'barre_over_open'
+FINGER_ORDER = 'finger_order'
+FINGER_SPAN = 'finger_span'
+REJECTION_RULES = (STRING_IN_USE, OPEN_UNDER_BARRE, FINGER_IN_USE, BARRE_OVER_OPEN, FINGER_ORDER,
+                   FINGER_SPAN)
+
+def distance(f_1, f_2, modifier = 1):
+    '''
+    Calculation for the Euclidean distance between two fingertips on the fretboard.
+    f_1: a tuple representing a finger, in the form (fret_no, string_no)
+    f_2: a tuple representing another finger, in the form (fret_no, string_no)
+    modifier: a factor representing how much easier this distance should be
+    considered than normal
+    Returns: a Decimal value
+    '''
+    return sqrt((f_2[FRET]*2.5-f_1[FRET]*2.5)**2+(f_2[STRING]-f_1[STRING])**2)/modifier
+
+# the furthest each pair of fingers can reach from each other, indexed by finger number
+MAX_FINGER_DISTANCES = [
+    [0, 0, 0, 0, 0],
+    [0, 0, distance((0,1), (3,6)), distance((0,1), (4,6)), distance((0,1), (5,6))],
+    [0, distance((0,1), (3,6)), 0, distance((0,1), (2,6)), distance((0,1), (4,6))],
+    [0, distance((0,1), (4,6)), distance((0,1), (2,6)), 0, distance((0,1), (1,6))],
+    [0, distance((0,1), (5,6)), distance((0,1), (4,6)), distance((0,1), (1,6)), 0]
+]
+# the most frets that any two fingers can span
+MAX_FRET_SPAN = int(max(max(row) for row in MAX_FINGER_DISTANCES) // 2.5)
+
 class Fingering:
     '''
     Class for a fingering pattern on a guitar fretboard.
-    fingers: a dictionary mapping each finger number to the list of positions being held by that
-    finger.
+    frets: the fret held on each string, or UNUSED
+    string_fingers: the finger holding each string (OPEN_FINGER for open strings), or UNUSED
+    finger_frets, finger_strings: the lowest position held by each finger, indexed by finger number
+    string_mask, open_mask, finger_mask: bitmasks of the used strings, open strings and fingers
+    is_barred: whether the index finger is holding more than one string
     stretch_cost: a float value representing the difficulty of playing this fingering
     '''
+    __slots__ = ('frets', 'string_fingers', 'finger_frets', 'finger_strings', 'string_mask',
+                 'open_mask', 'finger_mask', 'is_barred', 'stretch_cost')
+
+    max_finger_distances = MAX_FINGER_DISTANCES
 
     def __init__(self):
-        if not hasattr(Fingering, 'max_finger_distances'):
-            Fingering.max_finger_distances = [
-                [0,
-                Fingering.distance((0,1), (3,6)),
-                Fingering.distance((0,1), (4,6)),
-                Fingering.distance((0,1), (5,6))],
-                [Fingering.distance((0,1), (3,6)),
-                0,
-                Fingering.distance((0,1), (4,6))],
-                Fingering.distance((0,1), (2,6)),
-                [Fingering.distance((0,1), (4,6)),
-                Fingering.distance((0,1), (2,6)),
-                0,
-                Fingering.distance((0,1), (1,6))],
-                [Fingering.distance((0,1), (5,6)),
-                Fingering.distance((0,1), (4,6)),
-                Fingering.distance((0,1), (1,6)),
-                0]
-            ]
-        self.fingers = {}
+        self.frets = array('b', [UNUSED] * MAX_STRINGS)
+        self.string_fingers = array('b', [UNUSED] * MAX_STRINGS)
+        self.finger_frets = array('b', [UNUSED] * (NUM_FINGERS + 1))
+        self.finger_strings = array('b', [UNUSED] * (NUM_FINGERS + 1))
+        self.string_mask = 0
+        self.open_mask = 0
+        self.finger_mask = 0
+        self.is_barred = False
         self.stretch_cost = 0
-    
+
+    def copy(self):
+        other = Fingering.__new__(Fingering)
+        other.frets = self.frets[:]
+        other.string_fingers = self.string_fingers[:]
+        other.finger_frets = self.finger_frets[:]
+        other.finger_strings = self.finger_strings[:]
+        other.string_mask = self.string_mask
+        other.open_mask = self.open_mask
+        other.finger_mask = self.finger_mask
+        other.is_barred = self.is_barred
+        other.stretch_cost = self.stretch_cost
+        return other
+
+    def shifted(self, frets):
+        '''
+        Returns a copy of this fingering moved up the neck by the given number of frets. The caller
+        is responsible for keeping the result on the fretboard and away from open strings.
+        '''
+        other = self.copy()
+        for string in range(MAX_STRINGS):
+            if self.string_mask >> string & 1:
+                other.frets[string] += frets
+        for finger in HAND:
+            if self.finger_mask >> finger & 1:
+                other.finger_frets[finger] += frets
+        return other
+
+    def fret_range(self):
+        '''
+        Returns: the lowest and highest frets held in this fingering, or None if nothing is held
+        '''
+        held = [self.frets[string] for string in range(MAX_STRINGS) if self.string_mask >> string & 1]
+        if not held:
+            return None
+        return min(held), max(held)
+
+    def to_bytes(self):
+        '''
+        Returns: a compact serialization of this fingering, readable by Fingering.from_bytes
+        '''
+        return self.frets.tobytes() + self.string_fingers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        fingering = cls()
+        held = array('b')
+        held.frombytes(data)
+        for string in range(MAX_STRINGS):
+            if held[string] != UNUSED:
+                finger = held[MAX_STRINGS + string] or None
+                fingering.__add_position(finger, (held[string], string))
+        return fingering
+
+    @property
+    def fingers(self):
+        '''
+        A dictionary mapping each finger number (None for open strings) to the list of positions
+        being held by that finger.
+        '''
+        fingers = {}
+        for string in range(MAX_STRINGS):
+            if self.string_mask >> string & 1:
+                finger = self.string_fingers[string] or None
+                fingers.setdefault(finger, []).append((self.frets[string], string))
+        return fingers
+
     def cmp_positions(self, p1, p2):
         if p2[FRET] == p1[FRET]:
             return p2[STRING] - p1[STRING]
         return p2[FRET] - p1[FRET]
 
-    def try_add_position(self, f1, position):
-        existing_positions = self.get_all_positions()
-
-        is_barred = 1 in self.fingers and len(self.fingers[1]) > 1
-        top_barre_string = None if not is_barred else min([p[STRING] for p in self.fingers[1]])
-        max_open_string = max([p[STRING] for p in existing_positions])
+    def can_add_position(self, f1, position):
+        '''
+        Checks whether the position can be held by finger f1 (None for an open string) without
+        breaking any of the constraints of a playable fingering.
+        '''
+        return self.rejection_rule(f1, position) is None
 
-        prev_fingers = [f2 for f2 in self.fingers if f1 is not None and f2 < f1]
-        next_fingers = [f2 for f2 in self.fingers if f1 is not None and f2 > f1]
-        max_prev_finger = max([0] + prev_fingers)
-        min_next_finger = min([NUM_FINGERS + 1] + next_fingers)
-        passes_prev_finger = max_prev_finger > 0 and self.cmp_positions(self.fingers[max_prev_finger][0], position) > 0
-        passes_next_finger = min_next_finger < NUM_FINGERS + 1 and self.cmp_positions(position, self.fingers[min_next_finger][0]) > 0
+    def rejection_rule(self, f1, position):
+        '''
+        Returns: the first of the REJECTION_RULES that holding the position with finger f1 would
+        break, or None if it can be added
+        '''
+        fret, string = position
 
         # we can't have multiple notes on one string
-        if position[STRING] in [p[STRING] for p in existing_positions]:
-            return False
-        # we also can't have multiple notes on one finger unless the fret is barreable
-        if f1 in self.fingers and not (f1 == 1 and max_open_string < top_barre_string):
-            return False
+        if self.string_mask >> string & 1:
+            return STRING_IN_USE
+
+        if f1 is None:
+            # we can't place an open note beneath an existing barre
+            if self.is_barred and self.finger_strings[1] < string:
+                return OPEN_UNDER_BARRE
+            return None
+
+        if self.finger_mask >> f1 & 1:
+            # we also can't have multiple notes on one finger unless the fret is barreable
+            if f1 != 1 or fret != self.finger_frets[1]:
+                return FINGER_IN_USE
+            if self.open_mask >> min(string, self.finger_strings[1]):
+                return BARRE_OVER_OPEN
 
-        # we can't place an open note beneath an existing barre
-        if f1 is None and top_barre_string < position[STRING]:
-            return False
         # the new position must place the finger in between the fingers on either side of it
-        if passes_prev_finger or passes_next_finger:
-            return False
+        for f2 in range(f1 - 1, 0, -1):
+            if self.finger_mask >> f2 & 1:
+                if fret < self.finger_frets[f2] or (fret == self.finger_frets[f2]
+                                                    and string < self.finger_strings[f2]):
+                    return FINGER_ORDER
+                break
+        for f2 in range(f1 + 1, NUM_FINGERS + 1):
+            if self.finger_mask >> f2 & 1:
+                if fret > self.finger_frets[f2] or (fret == self.finger_frets[f2]
+                                                    and string > self.finger_strings[f2]):
+                    return FINGER_ORDER
+                break
+
         # the new position cannot place the finger outside its span with other fingers
-        for f2 in [f for f in range(NUM_FINGERS) if f in self.fingers]:
-            if Fingering.max_finger_distances[f1][f2] < Fingering.distance(position, self.fingers[f2][0]):
-                return False
-
-        # we can add the position to the fingering as long as the designated finger isn't being used
-        if f1 in self.fingers:
-            self.fingers[f1] += [position]
-            self.fingers[1].sort()
+        max_distances = MAX_FINGER_DISTANCES[f1]
+        for f2 in HAND:
+            if f2 != f1 and self.finger_mask >> f2 & 1:
+                fret_span = fret*2.5 - self.finger_frets[f2]*2.5
+                string_span = string - self.finger_strings[f2]
+                if max_distances[f2] < sqrt(fret_span**2 + string_span**2):
+                    return FINGER_SPAN
+
+        return None
+
+    def try_add_position(self, f1, position):
+        '''
+        Adds the position to this fingering if it is playable with finger f1.
+        Returns: True if the position was added
+        '''
+        if self.rejection_rule(f1, position) is not None:
+            return False
+        self.__add_position(f1, position)
+        return True
+
+    def with_position(self, f1, position):
+        '''
+        Returns a copy of this fingering with the position added, or None if it can't be played
+        with finger f1.
+        '''
+        if self.rejection_rule(f1, position) is not None:
+            return None
+        other = self.copy()
+        other.__add_position(f1, position)
+        return other
+
+    def __add_position(self, f1, position):
+        fret, string = position
+        finger = OPEN_FINGER if f1 is None else f1
+
+        self.frets[string] = fret
+        self.string_fingers[string] = finger
+        self.string_mask |= 1 << string
+        if f1 is None:
+            self.open_mask |= 1 << string
+            return
+
+        if self.finger_mask >> f1 & 1:
+            self.is_barred = True
+            self.finger_strings[f1] = min(string, self.finger_strings[f1])
         else:
-            self.fingers[f1] = [position]
+            self.finger_mask |= 1 << f1
+            self.finger_frets[f1] = fret
+            self.finger_strings[f1] = string
         self.stretch_cost = self.__calculate_stretch()
 
-        return True
-    
     def get_all_positions(self):
-        return [position for finger in self.fingers.values() for position in finger]
+        return [(self.frets[string], string)
+                for string in range(MAX_STRINGS)
+                if self.string_mask >> string & 1]
 
     def __calculate_stretch(self):
         '''
@@ -100,18 +256,15 @@ class Fingering:
         Returns: a Decimal value
         '''
         finger_stretch = 0
-
-        keys = sorted([k for k in self.fingers if k is not None])
-        if not keys:
-            return 0
-        
-        f_curr = keys[0]
-        for f_next in keys[1:]:
-            if self.fingers[f_next] is not None:
-                finger_stretch += Fingering.distance(self.fingers[f_curr][0],
-                                                         self.fingers[f_next][0],
-                                                         f_next - f_curr)
-                f_curr = f_next
+        f_curr = None
+        for f_next in HAND:
+            if not self.finger_mask >> f_next & 1:
+                continue
+            if f_curr is not None:
+                fret_span = self.finger_frets[f_next]*2.5 - self.finger_frets[f_curr]*2.5
+                string_span = self.finger_strings[f_next] - self.finger_strings[f_curr]
+                finger_stretch += sqrt(fret_span**2 + string_span**2)/(f_next - f_curr)
+            f_curr = f_next
 
         return finger_stretch
 
@@ -119,27 +272,36 @@ class Fingering:
     def distance(cls, f_1, f_2, modifier=1):
         '''
         Calculation for the Euclidean distance between two fingertips on the fretboard.
-        f_1: a tuple representing a finger, in the form (fret_no, string_no)
-        f_2: a tuple representing another finger, in the form (fret_no, string_no)
-        modifier: a factor representing how much easier this distance should be 
-        considered than normal
-        Returns: a Decimal value
+        See the module-level distance function.
         '''
-        return sqrt((f_2[FRET]*2.5-f_1[FRET]*2.5)**2+(f_2[STRING]-f_1[STRING])**2)/modifier
+        return distance(f_1, f_2, modifier)
 
     def transition(self, other):
         '''
-        Calculates the relative difficulty of moving from this fingering to another specified 
+        Calculates the relative difficulty of moving from this fingering to another specified
         fingering.
         other: a Fingering object representing the chord being moved to
-        finger_inactivity: an array representing how long each finger has been in-place
         Returns: a Decimal value
         '''
         finger_movement = 0
+        shared_fingers = self.finger_mask & other.finger_mask
 
-        for i in range(NUM_FINGERS):
-            if i + 1 in self.fingers and i + 1 in other.fingers:
-                curr_finger = self.fingers[i + 1]
-                next_finger = other.fingers[i + 1]
-                finger_movement += Fingering.distance(curr_finger[0], next_finger[0], 1)
+        for i in HAND:
+            if shared_fingers >> i & 1:
+                fret_span = other.finger_frets[i]*2.5 - self.finger_frets[i]*2.5
+                string_span = other.finger_strings[i] - self.finger_strings[i]
+                finger_movement += sqrt(fret_span**2 + string_span**2)/1
         return finger_movement
+
+def pack_fingerings(fingerings):
+    '''
+    Returns: the fingerings serialized back to back, readable by unpack_fingerings
+    '''
+    return b''.join(f.to_bytes() for f in fingerings)
+
+def unpack_fingerings(data):
+    '''
+    Returns: the list of Fingering objects serialized by pack_fingerings
+    '''
+    return [Fingering.from_bytes(data[i:i + FINGERING_SIZE])
+            for i in range(0, len(data), FINGERING_SIZE)]
@@ -0,0 +1,129 @@
+'''
+Defines the FingeringCache class, a persistent store of the fingerings generated for each chord that
+can be shared between runs and between processes.
+'''
+import sqlite3
+import time
+from Tabify.src.models.fingering import pack_fingerings, unpack_fingerings
+from Tabify.src.models.stats import CacheCounts
+
+# bump this whenever the rules for generating fingerings change, so stale entries are ignored
+CACHE_VERSION = 2
+# lookups are recorded in one write once this many have built up, rather than one write each
+USE_FLUSH_INTERVAL = 256
+# eviction frees this fraction of the cap, so a full cache isn't evicted on every put
+EVICTION_HEADROOM = 8
+
+class FingeringCache(CacheCounts):
+    '''
+    An SQLite-backed cache of fingerings with a least-recently-used size cap. Each process opens its
+    own connection; the database runs in write-ahead-log mode so readers don't block each other, and
+    the times entries were last used are written in batches so readers rarely need the write lock.
+    The connection is opened when the cache is first used and should be closed when it's done with,
+    which writes out the pending times and evicts anything over the cap.
+    path: the location of the database file
+    max_entries: the number of chords to keep before the least recently used ones are evicted
+    '''
+    def __init__(self, path, max_entries = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        # at least the number of rows in the table, counting this connection's puts since it was
+        # last counted
+        self.rows = 0
+        self.last_used = {}
+        self.connection = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        state['last_used'] = {}
+        return state
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS fingerings ('
+                                    'key TEXT PRIMARY KEY, '
+                                    'fingerings BLOB NOT NULL, '
+                                    'last_used INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS fingerings_last_used '
+                                    'ON fingerings (last_used)')
+            self.count_rows()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.evict()
+            self.connection.close()
+            self.connection = None
+
+    def count_rows(self):
+        self.rows = self.connection.execute('SELECT COUNT(*) FROM fingerings').fetchone()[0]
+
+    @staticmethod
+    def key(guitar, pitches):
+        '''
+        Builds the cache key for a chord on a guitar.
+        guitar: a Guitar object
+        pitches: the sorted MIDI numbers of the chord, as kept in the ChordTable
+        '''
+        return '{}|{}|{}|{}|{}|{}'.format(CACHE_VERSION,
+                                          ','.join(str(t) for t in guitar.tuning_midi),
+                                          guitar.num_frets,
+                                          guitar.num_strings,
+                                          guitar.max_fingerings,
+                                          ','.join(str(p) for p in pitches))
+
+    def get(self, guitar, pitches):
+        '''
+        Returns: the list of cached Fingering objects for the chord, or None if it isn't cached
+        '''
+        key = FingeringCache.key(guitar, pitches)
+        connection = self.connect()
+        row = connection.execute('SELECT fingerings FROM fingerings WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.last_used[key] = time.time_ns()
+        if len(self.last_used) >= USE_FLUSH_INTERVAL:
+            self.flush()
+        return unpack_fingerings(row[0])
+
+    def put(self, guitar, pitches, fingerings):
+        key = FingeringCache.key(guitar, pitches)
+        self.connect().execute('INSERT OR REPLACE INTO fingerings VALUES (?, ?, ?)',
+                               (key, pack_fingerings(fingerings), time.time_ns()))
+        self.last_used.pop(key, None)
+
+        self.rows += 1
+        if self.rows > self.max_entries:
+            self.evict(self.max_entries - self.max_entries // EVICTION_HEADROOM)
+
+    def flush(self):
+        '''
+        Writes the times of the lookups since the last flush in one transaction.
+        '''
+        if not self.last_used:
+            return
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN')
+            connection.executemany('UPDATE fingerings SET last_used = ? WHERE key = ?',
+                                   [(used, key) for key, used in self.last_used.items()])
+        self.last_used = {}
+
+    def evict(self, keep = None):
+        '''
+        Removes the least recently used entries beyond keep, or beyond max_entries by default.
+        '''
+        self.flush()
+        connection = self.connect()
+        connection.execute('DELETE FROM fingerings WHERE key IN '
+                           '(SELECT key FROM fingerings ORDER BY last_used DESC '
+                           'LIMIT -1 OFFSET ?)', (self.max_entries if keep is None else keep,))
+        self.count_rows()
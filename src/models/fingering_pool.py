@@ -0,0 +1,57 @@
+'''
+Generates the fingerings of many chords at once over a pool of worker processes. Each worker keeps
+its own Guitar, so chord shapes found in one chunk are reused for the rest of that worker's chunks,
+and sends back the fingerings of each chord packed into bytes rather than pickled objects.
+'''
+from concurrent.futures import ProcessPoolExecutor, wait
+from Tabify.src.models.fingering import pack_fingerings, unpack_fingerings
+from Tabify.src.models.guitar import Guitar
+
+# how many chunks each worker gets, so that a slow chunk doesn't hold up the others for long
+CHUNKS_PER_WORKER = 4
+# how often the caller hears from enumerate_fingerings while it waits for a chunk, in seconds
+WAIT_INTERVAL = 0.05
+
+_worker_guitar = None
+
+def _init_worker(tuning, num_frets, num_strings, max_fingerings):
+    global _worker_guitar
+    _worker_guitar = Guitar(tuning, num_frets, num_strings, max_fingerings)
+
+def _enumerate_chunk(chords):
+    '''
+    Returns: the packed fingerings of each chord of the chunk, in order
+    '''
+    return [pack_fingerings(_worker_guitar.get_fingerings(chord)) for chord in chords]
+
+def chunk(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def enumerate_fingerings(guitar, chords, workers, waiting = None):
+    '''
+    Finds the fingerings of every chord in a pool of worker processes.
+    guitar: the Guitar to find the fingerings on; only its settings are sent to the workers
+    chords: a list of the MIDI numbers of each chord
+    workers: the number of worker processes
+    waiting: a function called every WAIT_INTERVAL while a chunk is waited for; it can raise an
+    exception to stop
+    Yields: the list of Fingering objects of each chord, in order, as each chunk of chords is
+    finished
+    '''
+    size = max(1, -(-len(chords) // (workers * CHUNKS_PER_WORKER)))
+    executor = ProcessPoolExecutor(max_workers = workers,
+                                   initializer = _init_worker,
+                                   initargs = (guitar.tuning_midi, guitar.num_frets,
+                                               guitar.num_strings, guitar.max_fingerings))
+    try:
+        futures = [executor.submit(_enumerate_chunk, c) for c in chunk(chords, size)]
+        for future in futures:
+            if waiting is not None:
+                while not wait([future], timeout = WAIT_INTERVAL).done:
+                    waiting()
+            for data in future.result():
+                yield unpack_fingerings(data)
+    finally:
+        # a caller that stops early, like a cancelled transcription, doesn't wait for the chunks
+        # still queued
+        executor.shutdown(wait = False, cancel_futures = True)
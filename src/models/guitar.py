@@ -1,10 +1,9 @@
 '''
 
 '''
-from music21.pitch import Pitch
-from music21.interval import Interval
-from music21.chord import Chord
-from Tabify.src.models.fingering import Fingering, NUM_FINGERS, OPEN, HAND, FRET
+from itertools import combinations
+from numbers import Integral
+from Tabify.src.models.fingering import Fingering, NUM_FINGERS, OPEN, HAND, FRET, MAX_FRET_SPAN
 
 OCTAVE = 12
 MAX_REACH = 4
@@ -15,133 +14,405 @@ ELEVENTH = 4
 FIFTH = 5
 THIRTEENTH = 6
 SEVENTH = 7
+# the interval number of each count of semitones above a chord's root
+INTERVAL_NUMBERS = [ROOT, NINTH, NINTH, THIRD, THIRD, ELEVENTH, FIFTH, FIFTH, THIRTEENTH, THIRTEENTH,
+                    SEVENTH, SEVENTH]
+# how many thirds each interval number is stacked above the root
+THIRDS_ABOVE_ROOT = {ROOT: 0, THIRD: 1, FIFTH: 2, SEVENTH: 3, NINTH: 4, ELEVENTH: 5, THIRTEENTH: 6}
+# the order the notes of a chord are kept in when some have to be dropped
+INTERVAL_PRIORITY = [ROOT, THIRD, SEVENTH, THIRTEENTH, ELEVENTH, NINTH, FIFTH]
+MIDI_RANGE = 128
+NOTE_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+# E2 A2 D3 G3 B3 E4, with B1 added below for 7 strings and A4 above for 8
+STANDARD_TUNING = [40, 45, 50, 55, 59, 64]
+LOW_B = 35
+HIGH_A = 69
+# name: (tuning, number of strings); a tuning of None is the standard tuning for the string count
+TUNINGS = {
+    'standard': (None, 6),
+    'drop-d': ([38, 45, 50, 55, 59, 64], 6),
+    'dadgad': ([38, 45, 50, 55, 57, 62], 6),
+    'seven-string': (None, 7),
+    'eight-string': (None, 8),
+}
+
+# fretboard indices are shared between guitars with the same tuning and fret count
+_fretboard_indices = {}
+
+def midi_number(note):
+    '''
+    Returns the MIDI number of a music21 Note or Pitch; integers are passed through unchanged.
+    '''
+    if isinstance(note, Integral):
+        return int(note)
+    if hasattr(note, 'pitch'):
+        return note.pitch.midi
+    return note.midi
+
+def pitch_mask(pitches):
+    '''
+    Returns: a bitmask of the MIDI numbers, with bit n set for MIDI number n
+    '''
+    mask = 0
+    for pitch in pitches:
+        mask |= 1 << pitch
+    return mask
+
+def pitch_mask_union(masks):
+    union = 0
+    for mask in masks:
+        union |= mask
+    return union
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+def chord_root(pitch_classes, bass):
+    '''
+    Returns: the pitch class the others are stacked the fewest thirds above, preferring the bass
+    '''
+    return min(pitch_classes,
+               key = lambda root: (sum(THIRDS_ABOVE_ROOT[INTERVAL_NUMBERS[(pc - root) % OCTAVE]]
+                                       for pc in pitch_classes), root != bass, root))
+
+class FretboardIndex:
+    '''
+    Integer lookup tables for a tuning and fret count.
+    pitch_locations: a tuple indexed by MIDI number holding the (fret, string) positions of that pitch
+    fret_pitches: a tuple indexed by fret holding the set of MIDI numbers sounded by a barre there
+    fret_masks: the same sets as pitch bitmasks
+    window_masks: a tuple indexed by hand position holding a pitch bitmask for each string of the
+    notes fretted there, where the hand at position i covers frets i + 1 to i + 1 + MAX_FRET_SPAN
+    window_union_masks: the pitch bitmask of every note fretted at each hand position
+    '''
+    def __init__(self, tuning_midi, num_frets):
+        locations = [[] for _ in range(MIDI_RANGE)]
+        for string, open_midi in enumerate(tuning_midi):
+            for fret in range(num_frets + 1):
+                if 0 <= open_midi + fret < MIDI_RANGE:
+                    locations[open_midi + fret].append((fret, string))
+
+        self.pitch_locations = tuple(tuple(sorted(l, key = lambda p: p[1])) for l in locations)
+        self.fret_pitches = tuple(frozenset(t + fret for t in tuning_midi)
+                                  for fret in range(num_frets + 1))
+        self.fret_masks = tuple(pitch_mask(p for p in pitches if 0 <= p < MIDI_RANGE)
+                                for pitches in self.fret_pitches)
+        self.window_masks = tuple(
+            tuple(pitch_mask(t + fret
+                             for fret in range(low, min(low + MAX_FRET_SPAN, num_frets) + 1)
+                             if 0 <= t + fret < MIDI_RANGE)
+                  for t in tuning_midi)
+            for low in range(1, num_frets + 1))
+        self.window_union_masks = tuple(pitch_mask_union(masks) for masks in self.window_masks)
+
+    @classmethod
+    def get(cls, tuning_midi, num_frets):
+        key = (tuple(tuning_midi), num_frets)
+        if key not in _fretboard_indices:
+            _fretboard_indices[key] = cls(tuning_midi, num_frets)
+        return _fretboard_indices[key]
 
 class Guitar:
     '''
     
+    max_fingerings: if set, only the fingerings of each chord with the lowest stretch costs are kept
     '''
-    def __init__(self, tuning = None, num_frets = 15, num_strings = 6):
+    def __init__(self, tuning = None, num_frets = 15, num_strings = 6, max_fingerings = None):
         if not tuning:
-            self.tuning = [Pitch('E2'), Pitch('A2'), Pitch('D3'), Pitch('G3'), Pitch('B3'), Pitch('E4')]
+            self.tuning = list(STANDARD_TUNING)
             if num_strings in (7, 8):
-                self.tuning.insert(0, Pitch('B1'))
+                self.tuning.insert(0, LOW_B)
             if num_strings == 8:
-                self.tuning.push(Pitch('A4'))
+                self.tuning.append(HIGH_A)
         else:
             self.tuning = tuning
         self.num_frets = num_frets
         self.num_strings = num_strings
+        self.max_fingerings = max_fingerings
+
+        self.tuning_midi = [midi_number(t) for t in self.tuning]
+        self.index = FretboardIndex.get(self.tuning_midi, self.num_frets)
+
+        # fretted chord shapes are cached as the fingerings of the shape built on shape_base, which
+        # is above every open string so that the whole shape can be fretted on every string
+        self.shape_base = max(self.tuning_midi) + 1
+        self.shapes = {}
 
     def range_size(self):
-        return Interval(self.lowest_pitch(), self.highest_pitch()).semitones
+        return self.tuning_midi[-1] + self.num_frets - self.tuning_midi[0]
 
     def lowest_pitch(self):
-        return self.tuning[0]
+        from music21.pitch import Pitch # pylint: disable=import-outside-toplevel
+        return Pitch(midi = self.tuning_midi[0])
 
     def highest_pitch(self):
-        return self.tuning[-1].transpose(self.num_frets)
+        from music21.pitch import Pitch # pylint: disable=import-outside-toplevel
+        return Pitch(midi = self.tuning_midi[-1] + self.num_frets)
 
-    # todo: there might be a better way to write this, or maybe we can eliminate the need for it
     def is_barreable(self, notes):
-        for i in range(self.num_frets):
-            if len([n for n in notes if n not in [t.transpose(i) for t in self.tuning]]) < NUM_FINGERS:
+        return self.is_barreable_mask(pitch_mask(midi_number(n) for n in notes))
+
+    def is_barreable_mask(self, chord_mask):
+        '''
+        Returns: whether a barre at some fret sounds enough of the chord's pitches for the remaining
+        fingers to fret the rest
+        chord_mask: the pitch bitmask of the chord
+        '''
+        for barre_mask in self.index.fret_masks[:self.num_frets]:
+            if popcount(chord_mask & ~barre_mask) < NUM_FINGERS:
                 return True
         return False
 
-    def make_chord_playable(self, chord):
+    def fits_hand_position(self, pitches, chord_mask):
         '''
-        
+        Returns: whether the pitches can be put on separate strings with the fretted ones all within
+        one hand position and few enough for the fingers, counting the notes on the lowest fret of
+        the position as a single barre. Each note takes the lowest free string that has it, which
+        is enough for strings tuned low to high.
+        pitches: the MIDI numbers of the chord, lowest first
+        chord_mask: the pitch bitmask of the same chord
         '''
-        notes_by_name = {}
-        for note in chord:
-            if note.name not in notes_by_name:
-                notes_by_name[note.name] = [note]
+        open_mask = self.index.fret_masks[0]
+        fretted_mask = chord_mask & ~open_mask
+        for low, string_masks in enumerate(self.index.window_masks, 1):
+            if fretted_mask & ~self.index.window_union_masks[low - 1]:
+                continue
+
+            used = 0
+            fingers = 0
+            barre = False
+            for pitch in pitches:
+                bit = 1 << pitch
+                for string, open_midi in enumerate(self.tuning_midi):
+                    if used & (1 << string):
+                        continue
+                    if pitch == open_midi:
+                        break
+                    if string_masks[string] & bit:
+                        if pitch - open_midi == low:
+                            barre = True
+                        else:
+                            fingers += 1
+                        break
+                else:
+                    break
+                used |= 1 << string
             else:
-                notes_by_name[note.name] += [note]
-
-        bass_note = chord[0].name
-        high_note = chord[-1].name
-
-        chord_root = Chord(notes_by_name.keys()).root()
-        intervals = {int(Interval(chord_root, Pitch(p)).name[1:]): p for p in notes_by_name}
-        priority = [ROOT, THIRD, SEVENTH, THIRTEENTH, ELEVENTH, NINTH, FIFTH]
-        prioritized_notes = [bass_note, high_note] + [intervals[i]
-                                                      for i in priority
-                                                      if i in intervals
-                                                      and intervals[i] not in [bass_note,
-                                                                               high_note]]
-
-        if len(notes_by_name) > self.num_strings:
-            notes_by_name = {k: v
-                             for k, v in notes_by_name
-                             if k in prioritized_notes[:self.num_strings]}
-
-        new_chord = [chord[0]] + [notes_by_name[n][-1]
-                                  for n in notes_by_name
-                                  if notes_by_name[n][-1].name
-                                  not in [bass_note, high_note]] + [chord[-1]]
-        max_interval = Interval(self.tuning[0], self.tuning[-1]).semitones + MAX_REACH
-        chord_breadth = Interval(new_chord[0].pitch, new_chord[-1].pitch).semitones
-
-        if new_chord[0].pitch < self.lowest_pitch():
-            new_chord[0].pitch = new_chord[0].pitch.transpose(OCTAVE)
-            for note in new_chord[1:]:
-                if note.pitch < new_chord[0].pitch:
-                    note.pitch = note.pitch.transpose(OCTAVE)
-        if chord_breadth > max_interval and new_chord[0].pitch != self.tuning[0]:
-            new_chord[-1].pitch = new_chord[-1].pitch.transpose(-OCTAVE)
-            for note in new_chord[::-1][:-1]:
-                if note.pitch > new_chord[-1].pitch:
-                    note.pitch = note.pitch.transpose(-OCTAVE)
-
-        while not self.is_barreable(new_chord) and len(new_chord) > NUM_FINGERS:
-            new_chord = [n for n in new_chord if n.name in prioritized_notes[:len(new_chord)-1]]
-
-        return new_chord
+                if fingers + barre <= NUM_FINGERS:
+                    return True
+        return False
+
+    def make_chord_playable(self, chord):
+        '''
+        Reduces a chord to notes that can be played together. Unisons are merged, and chords that
+        then fit in a hand position are left as they are. Otherwise the notes are moved by octaves
+        into the range of the fretboard and within reach of the bass, only the highest note of each
+        pitch class besides the bass and top notes is kept, and then as few of those as possible are
+        dropped, least important interval first, until the fingering search finds a way to play the
+        chord. The bass and top notes are kept unless they can't be played together, in which case
+        the top note is kept on its own.
+        chord: a list of music21 Note objects or MIDI numbers
+        Returns: the sorted MIDI numbers of the playable chord
+        '''
+        pitches = sorted(set(midi_number(n) for n in chord))
+        if not pitches:
+            return []
+        lowest = min(self.tuning_midi)
+        highest = max(self.tuning_midi) + self.num_frets
+        if (len(pitches) <= self.num_strings and lowest <= pitches[0] and pitches[-1] <= highest
+                and self.can_finger(pitches, pitch_mask(pitches))):
+            return pitches
+
+        max_interval = self.tuning_midi[-1] - self.tuning_midi[0] + MAX_REACH
+        bass = pitches[0]
+        while bass < lowest:
+            bass += OCTAVE
+        while bass > highest:
+            bass -= OCTAVE
+        # the span only matters for fretted notes; an open low string can sit under anything
+        top = highest if bass == self.tuning_midi[0] else min(highest, bass + max_interval)
+        folded = {bass}
+        for pitch in pitches[1:]:
+            while pitch < bass:
+                pitch += OCTAVE
+            while pitch > top and pitch - OCTAVE >= bass:
+                pitch -= OCTAVE
+            folded.add(pitch)
+        pitches = sorted(folded)
+
+        bass, high = pitches[0], pitches[-1]
+        fixed = [bass] if bass == high else [bass, high]
+        # the highest note of each of the other pitch classes stands for the rest of them
+        middle = {p % OCTAVE: p
+                  for p in pitches[1:-1] if p % OCTAVE not in (bass % OCTAVE, high % OCTAVE)}
+
+        root = chord_root({p % OCTAVE for p in pitches}, bass % OCTAVE)
+        optional = sorted(middle.values(),
+                          key = lambda p: INTERVAL_PRIORITY.index(
+                              INTERVAL_NUMBERS[(p - root) % OCTAVE]))
+
+        # the biggest set of optional notes that fits wins, and among those of the same size the
+        # one keeping the most important notes; combinations() yields those first
+        fixed_mask = pitch_mask(fixed)
+        masks = [1 << p for p in optional]
+        room = max(self.num_strings - len(fixed), 0)
+        for size in range(min(len(optional), room), -1, -1):
+            for kept in combinations(range(len(optional)), size):
+                chord_mask = fixed_mask
+                for i in kept:
+                    chord_mask |= masks[i]
+                candidate = sorted(fixed + [optional[i] for i in kept])
+                if self.can_finger(candidate, chord_mask):
+                    return candidate
+        # the bass and top notes can be out of reach of each other, in which case the top note, as
+        # the likeliest to carry the melody, is kept on its own
+        for candidate in ([high], [bass]):
+            if self.get_fingerings(candidate):
+                return candidate
+        return []
+
+    def can_finger(self, pitches, chord_mask):
+        '''
+        Returns: whether the fingering search finds at least one fingering of the pitches; the
+        quicker fits_hand_position turns most of the chords that have none away first
+        pitches: the MIDI numbers of the chord, lowest first
+        chord_mask: the pitch bitmask of the same chord
+        '''
+        return self.fits_hand_position(pitches, chord_mask) and bool(self.get_fingerings(pitches))
 
     def get_pitch_locations(self, pitch):
-        return [(fret, string)
-                for string, fret
-                in enumerate([Interval(p, pitch).semitones for p in self.tuning])
-                if 0 <= fret <= self.num_frets]
+        midi = midi_number(pitch)
+        if not 0 <= midi < MIDI_RANGE:
+            return ()
+        return self.index.pitch_locations[midi]
 
-    def get_fingerings(self, chord):
-        fingerings = []
+    def get_unbounded_locations(self, pitch):
+        '''
+        Like get_pitch_locations, but on a fretboard with no limit on the frets.
+        '''
+        midi = midi_number(pitch)
+        return tuple((midi - t, string) for string, t in enumerate(self.tuning_midi))
 
-        for note in chord:
-            new_fingerings = []
-            viable_finger_positions = self.get_pitch_locations(note.pitch)
+    def get_fingerings(self, chord, stats = None):
+        '''
+        Finds every playable fingering of the chord. Chords without any open-string pitches are
+        the same shape wherever they're played, so their fingerings are generated once per shape
+        and moved to the requested position.
+        chord: a list of music21 Note objects or MIDI numbers
+        stats: a Stats object to count the work done in, if any
+        '''
+        pitches = [midi_number(n) for n in chord]
+        if not pitches or any(p in self.index.fret_pitches[0] for p in pitches):
+            fingerings = self.search_fingerings(pitches, self.get_pitch_locations, stats)
+        else:
+            lowest = min(pitches)
+            shape = tuple(p - lowest for p in pitches)
+            if shape not in self.shapes:
+                shape_fingerings = self.search_fingerings([self.shape_base + s for s in shape],
+                                                          self.get_unbounded_locations, stats)
+                self.shapes[shape] = [(f,) + f.fret_range() for f in shape_fingerings]
+                if stats is not None:
+                    stats.count('shape_cache.misses')
+            elif stats is not None:
+                stats.count('shape_cache.hits')
 
-            for position in viable_finger_positions:
-                usable_fingers = OPEN if position[FRET] == 0 else HAND
-                if not fingerings:
-                    new_fingerings = [Fingering().try_add_position(f, position)
-                                      for f
-                                      in usable_fingers]
+            shift = lowest - self.shape_base
+            fingerings = [f.shifted(shift)
+                          for f, low_fret, high_fret in self.shapes[shape]
+                          if 1 <= low_fret + shift and high_fret + shift <= self.num_frets]
 
-                for fingering in fingerings:
-                    new_fingerings += [fingering
-                                       for f
-                                       in usable_fingers
-                                       if fingering.try_add_position(f, position)]
+        if self.max_fingerings is not None and len(fingerings) > self.max_fingerings:
+            if stats is not None:
+                stats.count('fingerings.over_max', len(fingerings) - self.max_fingerings)
+            easiest = sorted(range(len(fingerings)), key = lambda i: fingerings[i].stretch_cost)
+            fingerings = [fingerings[i] for i in sorted(easiest[:self.max_fingerings])]
+        return fingerings
 
-            fingerings = new_fingerings
+    def search_fingerings(self, chord, get_locations, stats = None):
+        '''
+        Depth-first search for the fingerings of a chord, placing one note at a time in each of its
+        locations with each usable finger. Branches are cut as soon as a placement breaks a
+        constraint, and of the fingerings holding exactly the same positions only the one with the
+        lowest stretch cost is kept.
+        get_locations: a function returning the (fret, string) locations of a pitch
+        stats: a Stats object to count the fingerings found and the placements rejected by each
+        rule in, if any
+        '''
+        locations = [get_locations(note) for note in chord]
+        if len(locations) > self.num_strings:
+            if stats is not None:
+                stats.count('chords.too_many_notes')
+            return []
 
+        fingerings = []
+        easiest = {}
+        self.__extend_fingering(Fingering(), locations, 0, None, None, fingerings, easiest, stats)
+        if stats is not None:
+            stats.count('fingerings.kept', len(fingerings))
         return fingerings
 
+    def __extend_fingering(self, fingering, locations, depth, low_fret, high_fret, fingerings,
+                           easiest, stats):
+        if depth == len(locations):
+            positions = fingering.frets.tobytes()
+            if stats is not None:
+                stats.count('fingerings.generated')
+            if positions not in easiest:
+                easiest[positions] = len(fingerings)
+                fingerings.append(fingering)
+            elif fingering.stretch_cost < fingerings[easiest[positions]].stretch_cost:
+                fingerings[easiest[positions]] = fingering
+            return
+
+        for position in locations[depth]:
+            fret = position[FRET]
+            if fret == 0:
+                usable_fingers = OPEN
+                next_low, next_high = low_fret, high_fret
+            else:
+                # no pair of fingers can reach further than this, whichever fingers are used
+                if low_fret is not None and max(high_fret, fret) - min(low_fret, fret) > MAX_FRET_SPAN:
+                    if stats is not None:
+                        stats.count('placements.rejected.fret_span')
+                    continue
+                usable_fingers = HAND
+                next_low = fret if low_fret is None else min(low_fret, fret)
+                next_high = fret if high_fret is None else max(high_fret, fret)
+
+            for f in usable_fingers:
+                new_fingering = fingering.with_position(f, position)
+                if new_fingering is not None:
+                    self.__extend_fingering(new_fingering, locations, depth + 1, next_low,
+                                            next_high, fingerings, easiest, stats)
+                elif stats is not None:
+                    stats.count('placements.rejected.' + fingering.rejection_rule(f, position))
+
     def get_transposition(self, notes):
         '''
         Determine whether it is necessary to transpose a song into the playable range of the guitar,
         and return the optimal transposition interval (in semitones) if so.
-        notes: a list of music21 Note objects
+        notes: an iterable of music21 Note objects or MIDI numbers, read only once
+        '''
+        lowest = highest = None
+        for note in notes:
+            for pitch in getattr(note, 'pitches', [note]):
+                midi = midi_number(pitch)
+                if lowest is None or midi < lowest:
+                    lowest = midi
+                if highest is None or midi > highest:
+                    highest = midi
+        return self.get_range_transposition(lowest, highest)
+
+    def get_range_transposition(self, lowest, highest):
         '''
-        song_range = (min(notes, key = lambda n: n.pitch).pitch,
-                        max(notes, key = lambda n: n.pitch).pitch)
-        guitar_range = (self.lowest_pitch(), self.highest_pitch())
-        low_overshoot = Interval(song_range[0], guitar_range[0]).semitones
-        high_undershoot = Interval(song_range[1], guitar_range[1]).semitones
+        Like get_transposition, for a song whose lowest and highest MIDI numbers are already known.
+        '''
+        song_range = (lowest, highest)
+        guitar_range = (self.tuning_midi[0], self.tuning_midi[-1] + self.num_frets)
+        low_overshoot = guitar_range[0] - song_range[0]
+        high_undershoot = guitar_range[1] - song_range[1]
 
-        if Interval(song_range[0], song_range[1]).semitones > self.range_size():
+        if song_range[1] - song_range[0] > self.range_size():
             # if the range is just too wide, fix the high end of the song range to the high
             # end of the guitar range; we'll finish fixing the range later in the process
             return high_undershoot
@@ -162,4 +433,9 @@ class Guitar:
         return 0
 
     def as_tablature(self):
-        return [s.name + '|' for s in self.tuning].reverse()
+        '''
+        Returns: the label at the start of each line of tab, highest string first
+        '''
+        names = [s.name if hasattr(s, 'name') else NOTE_NAMES[s % OCTAVE] for s in self.tuning]
+        width = max(len(n) for n in names)
+        return [n.ljust(width) + '|' for n in reversed(names)]
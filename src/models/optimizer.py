@@ -0,0 +1,559 @@
+'''
+Defines the Optimizer class, which finds the least difficult sequence of fingerings through a song
+by dynamic programming over the candidate fingerings of each chord.
+'''
+from collections import deque, OrderedDict
+import numpy as np
+from Tabify.src.models.fingering import NUM_FINGERS
+from Tabify.src.models.stats import CacheCounts
+from Tabify.src.models.transcriber_configs import BEAM_SEARCH
+
+# relative costs are looked up to this precision to find a repeat entered the same way
+REPEAT_RESOLUTION = 1e-6
+# how many of the chord pairs that missed the transition cache are remembered, so that a pair a beam
+# search meets again has its whole matrix cached
+MISSED_KEYS = 2**16
+
+def finger_anchors(fingerings):
+    '''
+    Packs the finger positions of a list of fingerings into arrays for vectorized cost calculations.
+    fingerings: a list of Fingering objects
+    Returns: a tuple of (frets, strings, used) arrays of shape (len(fingerings), NUM_FINGERS), and
+    the array of stretch costs
+    '''
+    frets = np.array([f.finger_frets[1:] for f in fingerings], dtype = np.float64)
+    strings = np.array([f.finger_strings[1:] for f in fingerings], dtype = np.float64)
+    used = np.array([[f.finger_mask >> i & 1 for i in range(1, NUM_FINGERS + 1)]
+                     for f in fingerings], dtype = bool)
+    stretch = np.array([f.stretch_cost for f in fingerings], dtype = np.float64)
+    return (frets.reshape(-1, NUM_FINGERS), strings.reshape(-1, NUM_FINGERS),
+            used.reshape(-1, NUM_FINGERS)), stretch
+
+def transition_matrix(prev_anchors, next_anchors):
+    '''
+    Calculates Fingering.transition between every pair of fingerings in two layers.
+    prev_anchors, next_anchors: anchor arrays as returned by finger_anchors
+    Returns: an array of shape (len(prev), len(next))
+    '''
+    prev_frets, prev_strings, prev_used = prev_anchors
+    next_frets, next_strings, next_used = next_anchors
+    movement = np.zeros((len(prev_frets), len(next_frets)))
+
+    for i in range(NUM_FINGERS):
+        fret_span = next_frets[None, :, i]*2.5 - prev_frets[:, None, i]*2.5
+        string_span = next_strings[None, :, i] - prev_strings[:, None, i]
+        shared = prev_used[:, None, i] & next_used[None, :, i]
+        movement += np.where(shared, np.sqrt(fret_span**2 + string_span**2)/1, 0)
+    return movement
+
+class TransitionCache(CacheCounts):
+    '''
+    A least-recently-used cache of transition matrices between the fingerings of two chords, keyed
+    by their chord ids, so a progression that comes round again costs lookups instead of matrices.
+    max_bytes: the total size of the matrices to keep
+    missed: the keys of the last MISSED_KEYS misses
+    '''
+    def __init__(self, max_bytes = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.matrices = OrderedDict()
+        self.missed = OrderedDict()
+
+    def get(self, key):
+        matrix = self.matrices.get(key)
+        if matrix is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.matrices.move_to_end(key)
+        return matrix
+
+    def wants(self, key):
+        '''
+        Returns: whether the whole matrix for a key that just missed is worth calculating to cache,
+        rather than only the rows that are needed; only keys that have missed before are, so that
+        pairs of chords that never come round again don't cost more than they did uncached
+        '''
+        if not self.max_bytes:
+            return False
+        if key in self.missed:
+            del self.missed[key]
+            return True
+        self.missed[key] = None
+        if len(self.missed) > MISSED_KEYS:
+            self.missed.popitem(last = False)
+        return False
+
+    def put(self, key, matrix):
+        if matrix.nbytes > self.max_bytes:
+            return
+        if key in self.matrices:
+            self.size -= self.matrices.pop(key).nbytes
+        self.matrices[key] = matrix
+        self.size += matrix.nbytes
+        while self.size > self.max_bytes:
+            _, old_matrix = self.matrices.popitem(last = False)
+            self.size -= old_matrix.nbytes
+
+class Optimizer:
+    '''
+    Viterbi search for the fingering path with the lowest total cost.
+    configs: a TranscriberConfigs object supplying the cost weights
+    transition_cache: the TransitionCache to share between solves, which must only ever see chord
+    ids from the same chord table and guitar; each Optimizer has its own by default
+    costs: the best total cost of reaching each fingering of each layer, from the last solve()
+    backpointers: the index in the previous non-empty layer that each of those costs came from
+    total_cost: the cost of the path found by the last solve()
+    edges: the number of transitions between fingerings evaluated by the last solve
+    reused: the number of layers of the last solve() that followed a repeat of them
+    layers, chord_ids: the candidate fingerings and chord id of each chord of the last solve()
+    future_costs: for each fingering of each layer of the last solve(), the cost of the best way to
+    finish the song from it; computed by backward() when it's first needed
+    forward_pointers: the next non-empty layer after each layer, and the fingering in it that each
+    of those best finishes goes through
+    '''
+    def __init__(self, configs, transition_cache = None):
+        self.configs = configs
+        self.transition_cache = transition_cache
+        if transition_cache is None:
+            self.transition_cache = TransitionCache(configs.transition_cache_size)
+        self.costs = []
+        self.backpointers = []
+        self.total_cost = None
+        self.anchors = {}
+        self.edges = 0
+        self.reused = 0
+        self.layers = None
+        self.chord_ids = None
+        self.future_costs = None
+        self.forward_pointers = None
+
+    def survivors(self, costs):
+        '''
+        Picks the fingerings of a layer that paths are extended from. In beam search, only the
+        beam_width cheapest and/or those within beam_threshold of the cheapest are kept.
+        Returns: an array of indices into the layer, in ascending order
+        '''
+        if self.configs.search != BEAM_SEARCH:
+            return np.arange(len(costs))
+
+        alive = np.ones(len(costs), dtype = bool)
+        if self.configs.beam_threshold is not None:
+            alive &= costs <= costs.min() + self.configs.beam_threshold
+        if self.configs.beam_width is not None and np.count_nonzero(alive) > self.configs.beam_width:
+            ranked = np.argsort(np.where(alive, costs, np.inf), kind = 'stable')
+            alive[:] = False
+            alive[ranked[:self.configs.beam_width]] = True
+        return np.flatnonzero(alive)
+
+    def solve(self, chord_ids, get_fingerings, segments = ()):
+        '''
+        Finds the optimal path through the chords (or, in beam search, a path that is close to it).
+        Chords with no fingerings are skipped over and produce None in the result.
+        chord_ids: the interned id of each chord in the song
+        get_fingerings: a function returning the list of candidate Fingering objects for a chord id
+        segments: (start, length) runs of chords that repeat each other, as found by find_repeats.
+        In exact search, a run entered from the same chord with nearly the same relative costs as an
+        identical run before it is extended along that run's choices by replay_span(), which gives
+        exactly the same result as searching it again.
+        Returns: a tuple of the list of chosen Fingering objects and the total cost of the path
+        '''
+        self.costs = []
+        self.backpointers = []
+        self.anchors = {}
+        self.edges = 0
+        self.reused = 0
+        self.future_costs = None
+        self.forward_pointers = None
+        self.layers = []
+        self.chord_ids = list(chord_ids)
+        if self.configs.search == BEAM_SEARCH:
+            # the beam is cut on costs a replay can be a rounding error off, which could change it
+            segments = ()
+
+        # the costs, survivors and chord id of the last non-empty layer
+        state = (None, None, None)
+        steps = {}
+        solved = {}
+        i = 0
+        for start, length in sorted(segments):
+            state = self.solve_span(i, start, get_fingerings, state)
+            i = start + length
+            costs, _, prev_id = state
+            if costs is None:
+                state = self.solve_span(start, i, get_fingerings, state)
+                continue
+            relative = costs - costs.min()
+            key = (prev_id, tuple(self.chord_ids[start:i]),
+                   np.round(relative / REPEAT_RESOLUTION).astype(np.int64).tobytes())
+            if key in solved:
+                state = self.replay_span(start, length, *solved[key], state, steps)
+            else:
+                solved[key] = (start, relative)
+                state = self.solve_span(start, i, get_fingerings, state, steps)
+        self.solve_span(i, len(self.chord_ids), get_fingerings, state)
+
+        return self.traceback(self.layers)
+
+    def solve_span(self, start, end, get_fingerings, state, steps = None):
+        '''
+        Extends the last solve() over its chords from start to end.
+        state: the costs, survivors and chord id of the last non-empty layer before start
+        steps: if given, what replay_span() needs to repeat each layer is added to it by index
+        Returns: the state after the last chord
+        '''
+        costs, alive, prev_id = state
+        for i in range(start, end):
+            chord_id = self.chord_ids[i]
+            layer = get_fingerings(chord_id)
+            self.layers.append(layer)
+            if not layer:
+                self.costs.append(None)
+                self.backpointers.append(None)
+                continue
+
+            record = None if steps is None or costs is None else []
+            costs, backpointer, alive = self.extend(chord_id, layer, costs, alive, prev_id, record)
+            if record:
+                steps[i] = record[0]
+            prev_id = chord_id
+            self.costs.append(costs)
+            self.backpointers.append(backpointer)
+        return costs, alive, prev_id
+
+    def replay_span(self, start, length, source, source_relative, state, steps):
+        '''
+        Extends the last solve() over the length chords from start, which are the same as those
+        from source and are entered from the same chord, by following the choices made at source.
+        The entry costs may differ from those at source by a constant and a small drift, and each
+        layer adds at most a rounding error to that drift. A fingering whose best predecessor at
+        source won by more than twice the drift must have the same one here, so its cost is that
+        predecessor's plus the recorded step; any other fingering is searched as usual. Either way
+        the sums are the ones a search would make, so the result is exactly the same.
+        source_relative: the entry costs at source, less their minimum
+        Returns: the state after the last chord, as for solve_span()
+        '''
+        costs, alive, prev_id = state
+        drift = np.abs((costs - costs.min()) - source_relative).max()
+        last = max((i for i in range(source, source + length) if self.costs[i] is not None),
+                   default = None)
+        if last is not None:
+            # every cost is positive, so none in the span exceeds this
+            rounding = 8 * np.spacing(costs.max() + self.costs[last].max())
+        for i in range(source, source + length):
+            layer = self.layers[i]
+            self.layers.append(layer)
+            if self.costs[i] is None:
+                self.costs.append(None)
+                self.backpointers.append(None)
+                continue
+
+            chord_id = self.chord_ids[i]
+            margins, least_margin, steps_in, stretch = steps[i]
+            drift += rounding
+            backpointer = self.backpointers[i]
+            new_costs = costs[backpointer] + steps_in + stretch
+            if least_margin <= 2 * drift:
+                unsure = np.flatnonzero(margins <= 2 * drift)
+                transitions = self.transitions(prev_id, chord_id)[:, unsure]
+                candidates = costs[:, None] + self.configs.transition_weight * transitions + \
+                             stretch[None, unsure]
+                best = np.argmin(candidates, axis = 0)
+                backpointer = backpointer.copy()
+                backpointer[unsure] = best
+                new_costs[unsure] = candidates[best, np.arange(len(unsure))]
+            costs = new_costs
+            prev_id = chord_id
+            self.costs.append(costs)
+            self.backpointers.append(backpointer)
+            self.reused += 1
+        if last is None:
+            return costs, alive, prev_id
+        return costs, self.survivors(costs), prev_id
+
+    def solve_online(self, chord_ids, get_fingerings, lookahead):
+        '''
+        Streaming version of solve() that only keeps a window of layers in memory. Once lookahead
+        more layers have been seen after a layer, it commits to that layer's fingering on the
+        current best path and drops every path that disagrees with it. With a lookahead at least
+        as long as the song, the result is the same as solve().
+        chord_ids: an iterable of the interned id of each chord in the song
+        get_fingerings: a function returning the list of candidate Fingering objects for a chord id
+        Yields: the chosen Fingering object for each chord (None for chords with no fingerings)
+        '''
+        self.anchors = {}
+        self.edges = 0
+        window = deque()
+
+        costs = None
+        alive = None
+        prev_id = None
+        for chord_id in chord_ids:
+            layer = get_fingerings(chord_id)
+            backpointer = None
+            if layer:
+                costs, backpointer, alive = self.extend(chord_id, layer, costs, alive, prev_id)
+                prev_id = chord_id
+            window.append((layer, backpointer))
+
+            if len(window) > lookahead:
+                oldest_layer, _ = window[0]
+                if oldest_layer:
+                    # find which fingering of the oldest layer each current path passes through
+                    ancestors = np.arange(len(costs))
+                    for _, later_backpointer in list(window)[:0:-1]:
+                        if later_backpointer is not None:
+                            ancestors = later_backpointer[ancestors]
+                    choice = ancestors[np.argmin(costs)]
+                    costs = np.where(ancestors == choice, costs, np.inf)
+                    yield oldest_layer[choice]
+                else:
+                    yield None
+                window.popleft()
+
+        path = []
+        choice = None if costs is None else int(np.argmin(costs))
+        for layer, backpointer in reversed(window):
+            if backpointer is None:
+                path.append(None)
+                continue
+            path.append(layer[choice])
+            choice = int(backpointer[choice])
+        yield from reversed(path)
+
+    def layer_anchors(self, chord_id, layer):
+        if chord_id not in self.anchors:
+            self.anchors[chord_id] = finger_anchors(layer)
+        return self.anchors[chord_id]
+
+    def transitions(self, prev_id, chord_id, alive = None):
+        '''
+        Returns: the transition matrix from the fingerings of one chord (only those in alive, if
+        it's given) to those of another; both chords' anchors must already be known. Whole matrices
+        are kept in the transition cache. On a miss, the rows of a subset are calculated on their
+        own, unless the pair of chords has missed before, in which case the whole matrix is
+        calculated and cached, so that beam searches hit the cache too.
+        '''
+        key = (prev_id, chord_id)
+        matrix = self.transition_cache.get(key)
+        if matrix is None:
+            prev_anchors = self.anchors[prev_id][0]
+            if alive is not None and not self.transition_cache.wants(key):
+                matrix = transition_matrix(tuple(a[alive] for a in prev_anchors),
+                                           self.anchors[chord_id][0])
+                self.edges += matrix.size
+                return matrix
+            matrix = transition_matrix(prev_anchors, self.anchors[chord_id][0])
+            self.edges += matrix.size
+            self.transition_cache.put(key, matrix)
+        return matrix if alive is None else matrix[alive]
+
+    def extend(self, chord_id, layer, costs, alive, prev_id, record = None):
+        '''
+        Extends the best paths ending in the surviving fingerings of the previous layer (if any) to
+        each fingering of a new layer.
+        prev_id: the chord id of the previous non-empty layer
+        record: a list to add what replay_span() needs to repeat the layer to: how far each
+        fingering's best predecessor beat the next best, the least of those, and the weighted
+        transition and stretch costs of the best paths
+        Returns: the costs and backpointers of the new layer, and its survivors
+        '''
+        _, stretch = self.layer_anchors(chord_id, layer)
+
+        if costs is None:
+            costs = self.configs.stretch_weight * stretch
+            backpointer = np.zeros(len(layer), dtype = np.intp)
+        else:
+            transitions = self.transitions(prev_id, chord_id,
+                                           None if len(alive) == len(costs) else alive)
+            candidates = costs[alive, None] + self.configs.transition_weight * transitions + \
+                         self.configs.stretch_weight * stretch[None, :]
+            best = np.argmin(candidates, axis = 0)
+            columns = np.arange(len(layer))
+            costs = candidates[best, columns]
+            backpointer = alive[best]
+            if record is not None:
+                margins = np.full(len(layer), np.inf)
+                if len(candidates) > 1:
+                    lowest = np.partition(candidates, 1, axis = 0)
+                    margins = lowest[1] - lowest[0]
+                record.append((margins, margins.min(),
+                               self.configs.transition_weight * transitions[best, columns],
+                               self.configs.stretch_weight * stretch))
+
+        return costs, backpointer, self.survivors(costs)
+
+    def solve_weights(self, chord_ids, get_fingerings, weights):
+        '''
+        Exact solve() for several weightings of the costs at once. The transitions between each pair
+        of layers are calculated once, and the path costs of every weighting are extended together
+        as the rows of one array.
+        weights: a list of (stretch weight, transition weight) pairs
+        Returns: a list of tuples of the chosen Fingering objects and the total cost of the path, one
+        for each weighting
+        '''
+        self.anchors = {}
+        self.edges = 0
+        stretch_weights = np.array([w[0] for w in weights], dtype = np.float64)[:, None]
+        transition_weights = np.array([w[1] for w in weights], dtype = np.float64)[:, None, None]
+
+        costs = None
+        prev_id = None
+        layers = []
+        backpointers = []
+        for chord_id in chord_ids:
+            layer = get_fingerings(chord_id)
+            layers.append(layer)
+            if not layer:
+                backpointers.append(None)
+                continue
+
+            _, stretch = self.layer_anchors(chord_id, layer)
+            if costs is None:
+                costs = stretch_weights * stretch[None, :]
+                backpointer = np.zeros(costs.shape, dtype = np.intp)
+            else:
+                transitions = self.transitions(prev_id, chord_id)
+                candidates = costs[:, :, None] + transition_weights * transitions[None] + \
+                             (stretch_weights * stretch[None, :])[:, None, :]
+                backpointer = np.argmin(candidates, axis = 1)
+                costs = np.take_along_axis(candidates, backpointer[:, None, :], axis = 1)[:, 0]
+            backpointers.append(backpointer)
+            prev_id = chord_id
+
+        results = []
+        for row in range(len(weights)):
+            path = [None] * len(layers)
+            total_cost = None
+            choice = None
+            for i in range(len(layers) - 1, -1, -1):
+                if backpointers[i] is None:
+                    continue
+                if choice is None:
+                    choice = int(np.argmin(costs[row]))
+                    total_cost = float(costs[row][choice])
+                path[i] = layers[i][choice]
+                choice = int(backpointers[i][row][choice])
+            results.append((path, total_cost))
+        return results
+
+    def traceback(self, layers):
+        '''
+        Follows the backpointers of the last solve() from the cheapest final fingering.
+        Returns: a tuple of the list of chosen Fingering objects and the total cost of the path
+        '''
+        path = [None] * len(layers)
+        total_cost = None
+        choice = None
+        for i in range(len(layers) - 1, -1, -1):
+            if self.costs[i] is None:
+                continue
+            if choice is None:
+                choice = int(np.argmin(self.costs[i]))
+                total_cost = float(self.costs[i][choice])
+            path[i] = layers[i][choice]
+            choice = int(self.backpointers[i][choice])
+
+        self.total_cost = total_cost
+        return path, total_cost
+
+    def step_costs(self, from_index, to_index):
+        '''
+        Returns: the weighted cost of moving from each fingering of one layer of the last solve() to
+        each fingering of a later one, including the stretch of the later one, as an array of shape
+        (len(from layer), len(to layer))
+        '''
+        self.layer_anchors(self.chord_ids[from_index], self.layers[from_index])
+        _, to_stretch = self.layer_anchors(self.chord_ids[to_index], self.layers[to_index])
+        transitions = self.transitions(self.chord_ids[from_index], self.chord_ids[to_index])
+        return (self.configs.transition_weight * transitions +
+                self.configs.stretch_weight * to_stretch[None, :])
+
+    def backward(self):
+        '''
+        The backward half of the forward-backward pass: fills in future_costs and forward_pointers
+        for the last solve(), so that paths can be continued from any fingering without searching.
+        '''
+        self.future_costs = [None] * len(self.layers)
+        self.forward_pointers = [None] * len(self.layers)
+        next_index = None
+        for i in range(len(self.layers) - 1, -1, -1):
+            if self.costs[i] is None:
+                continue
+            if next_index is None:
+                self.future_costs[i] = np.zeros(len(self.layers[i]))
+            else:
+                candidates = self.step_costs(i, next_index) + self.future_costs[next_index][None, :]
+                best = np.argmin(candidates, axis = 1)
+                self.future_costs[i] = candidates[np.arange(len(best)), best]
+                self.forward_pointers[i] = (next_index, best)
+            next_index = i
+
+    def solve_pinned(self, pins):
+        '''
+        Finds the best path through the chords of the last solve() that uses the given fingerings at
+        the given chords. Before the first pin, the path follows the backpointers of solve(), and
+        after the last it follows the forward pointers of backward(), so only the chords between
+        pins are searched again.
+        pins: a dict of chord index to the index of the fingering to use from that chord's layer
+        Returns: a tuple of the list of chosen Fingering objects and the total cost of the path
+        '''
+        if not pins:
+            return self.traceback(self.layers)
+        for i in pins:
+            if self.costs[i] is None:
+                raise ValueError(f'Chord {i} has no fingerings to pin')
+        if self.future_costs is None:
+            self.backward()
+
+        indices = sorted(pins)
+        choices = [None] * len(self.layers)
+
+        choice = pins[indices[0]]
+        total_cost = float(self.costs[indices[0]][choice])
+        for i in range(indices[0], -1, -1):
+            if self.costs[i] is not None:
+                choices[i] = choice
+                choice = int(self.backpointers[i][choice])
+
+        for start, end in zip(indices, indices[1:]):
+            total_cost += self.solve_segment(start, pins[start], end, pins[end], choices)
+
+        i = indices[-1]
+        choice = pins[i]
+        total_cost += float(self.future_costs[i][choice])
+        while self.forward_pointers[i] is not None:
+            i, best = self.forward_pointers[i][0], self.forward_pointers[i][1]
+            choice = int(best[choice])
+            choices[i] = choice
+
+        path = [None if c is None else layer[c] for layer, c in zip(self.layers, choices)]
+        return path, total_cost
+
+    def solve_segment(self, start, start_choice, end, end_choice, choices):
+        '''
+        Viterbi search between two pinned fingerings, writing the chosen fingering indices of the
+        chords in between into choices.
+        Returns: the cost of the segment, not counting the stretch of the first fingering
+        '''
+        costs = np.zeros(1)
+        prev_index = start
+        prev_choices = np.array([start_choice])
+        steps = []
+        for i in range(start + 1, end + 1):
+            if self.costs[i] is None:
+                continue
+            candidates = costs[:, None] + self.step_costs(prev_index, i)[prev_choices]
+            if i == end:
+                candidates = candidates[:, [end_choice]]
+            best = np.argmin(candidates, axis = 0)
+            costs = candidates[best, np.arange(candidates.shape[1])]
+            steps.append((i, prev_choices[best]))
+            prev_index = i
+            prev_choices = np.array([end_choice]) if i == end else np.arange(len(self.layers[i]))
+
+        position = 0
+        for i, back in reversed(steps):
+            choices[i] = end_choice if i == end else position
+            position = int(back[position])
+        return float(costs[0])
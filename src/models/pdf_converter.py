@@ -0,0 +1,100 @@
+'''
+Converts scores into PDFs for the score viewer, keeping each PDF in a cache directory named after the
+contents of the score so that an unchanged score is only engraved once.
+'''
+import os
+import subprocess
+import tempfile
+from Tabify.src.models.score_cache import content_hash
+
+DEFAULT_PDF_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'tabify', 'pdf')
+MUSESCORE_COMMAND = 'mscore3'
+
+def blank_pdf(width = 612, height = 792):
+    '''
+    Returns: the bytes of a PDF with a single blank page of the given size in points
+    '''
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+               b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] >>' % (width, height)]
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1,
+                                                                              xref)
+    return bytes(data)
+
+class MuseScoreConverter:
+    '''
+    Engraves scores with the MuseScore command line.
+    command: the MuseScore executable
+    '''
+    def __init__(self, command = MUSESCORE_COMMAND):
+        self.command = command
+
+    def convert(self, input_file, output_file):
+        subprocess.run([self.command, input_file, '-o', output_file], check = True,
+                       stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+
+class StubConverter:
+    '''
+    Writes the same PDF for every score instead of engraving it, for tests and for machines
+    without MuseScore.
+    pdf_data: the PDF to write; a blank page by default
+    conversions: the input files converted so far
+    '''
+    def __init__(self, pdf_data = None):
+        self.pdf_data = blank_pdf() if pdf_data is None else pdf_data
+        self.conversions = []
+
+    def convert(self, input_file, output_file):
+        self.conversions.append(input_file)
+        with open(output_file, 'wb') as pdf_file:
+            pdf_file.write(self.pdf_data)
+
+class PdfCache:
+    '''
+    A directory of PDFs named after the content hash of the scores they were made from.
+    directory: where the PDFs are kept; created if it doesn't exist
+    converter: the object whose convert(input_file, output_file) method makes a PDF
+    '''
+    def __init__(self, directory = DEFAULT_PDF_CACHE, converter = None):
+        self.directory = directory
+        self.converter = MuseScoreConverter() if converter is None else converter
+
+    def path(self, input_file):
+        return os.path.join(self.directory, content_hash(input_file) + '.pdf')
+
+    def get(self, input_file):
+        '''
+        Returns: the cached PDF of the score, or None if it hasn't been converted
+        '''
+        path = self.path(input_file)
+        return path if os.path.exists(path) else None
+
+    def convert(self, input_file):
+        '''
+        Converts the score unless it's already cached. The PDF is written under a temporary name and
+        then moved into place, so a failed or concurrent conversion never leaves a partial file.
+        Returns: the path of the PDF
+        '''
+        path = self.path(input_file)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(self.directory, exist_ok = True)
+        handle, temp_path = tempfile.mkstemp(dir = self.directory, suffix = '.pdf')
+        os.close(handle)
+        try:
+            self.converter.convert(input_file, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return path
@@ -0,0 +1,88 @@
+'''
+Finds the stretches of a song's chord sequence that repeat earlier ones, such as repeated measures,
+choruses and verses, so that the optimizer can reuse what it worked out the first time.
+'''
+from bisect import bisect_left
+from collections import Counter
+
+# runs of fewer chords than this cost more to look up than to solve
+MIN_REPEAT_LENGTH = 8
+HASH_BASE = 1000003
+HASH_MODULUS = 2**61 - 1
+
+def window_hashes(chord_ids, length):
+    '''
+    Returns: the Rabin-Karp hash of every window of the given length, indexed by where it starts
+    '''
+    top = pow(HASH_BASE, length - 1, HASH_MODULUS)
+    hashes = []
+    value = 0
+    for i, chord_id in enumerate(chord_ids):
+        if i >= length:
+            value = (value - (chord_ids[i - length] + 1) * top) % HASH_MODULUS
+        value = (value * HASH_BASE + chord_id + 1) % HASH_MODULUS
+        if i >= length - 1:
+            hashes.append(value)
+    return hashes
+
+def add_segment(segments, start, length):
+    '''
+    Adds a segment to a sorted list of segments unless it overlaps one already there.
+    '''
+    i = bisect_left(segments, (start, length))
+    if i > 0 and segments[i - 1][0] + segments[i - 1][1] > start:
+        return
+    if i < len(segments) and start + length > segments[i][0]:
+        return
+    segments.insert(i, (start, length))
+
+def find_repeats(chord_ids, min_length = MIN_REPEAT_LENGTH):
+    '''
+    Finds runs of chords that copy an earlier run, by looking up a rolling hash of each window of
+    min_length chords among the windows before it and extending each match as far as it goes. A run
+    that overlaps what it copies repeats with a period shorter than itself, so it's cut into pieces
+    a whole number of periods long, which are all copies of each other. The earlier run each piece
+    copies is included too, where it doesn't overlap anything, so that the first time through can be
+    reused as well, and a piece left with no copy among the segments is dropped.
+    chord_ids: the sequence of chord ids of a song
+    Returns: a sorted list of the (start, length) of segments that don't overlap, each of which has
+    the same chords as at least one other
+    '''
+    chord_ids = list(chord_ids)
+    if min_length < 1 or len(chord_ids) < 2 * min_length:
+        return []
+    hashes = window_hashes(chord_ids, min_length)
+
+    first_seen = {}
+    segments = []
+    seen = 0
+    i = 0
+    while i < len(hashes):
+        while seen < i:
+            first_seen.setdefault(hashes[seen], seen)
+            seen += 1
+        j = first_seen.get(hashes[i])
+        if j is None or chord_ids[j:j + min_length] != chord_ids[i:i + min_length]:
+            i += 1
+            continue
+
+        length = min_length
+        while i + length < len(chord_ids) and chord_ids[i + length] == chord_ids[j + length]:
+            length += 1
+        period = i - j
+        piece = length if period >= length else period * -(-min_length // period)
+        count = length // piece
+        if count == 0:
+            i += 1
+            continue
+
+        if j + piece <= i:
+            add_segment(segments, j, piece)
+        for k in range(count):
+            add_segment(segments, i + k * piece, piece)
+        i += count * piece
+
+    # a piece whose source overlapped an earlier segment may have been left on its own
+    contents = Counter(tuple(chord_ids[start:start + length]) for start, length in segments)
+    return [(start, length) for start, length in segments
+            if contents[tuple(chord_ids[start:start + length])] > 1]
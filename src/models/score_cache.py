@@ -0,0 +1,110 @@
+'''
+Defines the ScoreCache class, a persistent store of the note events read from each score, so a score
+that's transcribed again (e.g. with different TranscriberConfigs) doesn't have to be parsed again.
+'''
+import hashlib
+import os
+import tempfile
+import numpy as np
+from Tabify.src.models.score_reader import read_score, NOTE_EVENT, READER_VERSION
+from Tabify.src.models.stats import CacheCounts
+
+CACHE_EXTENSION = '.npy'
+HASH_CHUNK_SIZE = 2**20
+
+def content_hash(input_file):
+    '''
+    Returns: the SHA-256 hex digest of the file's contents
+    '''
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as score_file:
+        for chunk in iter(lambda: score_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ScoreCache(CacheCounts):
+    '''
+    A directory of .npy files holding the NOTE_EVENT array of each score, named after the hash of
+    the score's contents and the version of the readers. Once the files take up more than max_bytes,
+    the least recently used ones are deleted. Entries are written atomically, so the cache can be
+    shared between processes.
+    directory: where the cached arrays are kept; created if it doesn't exist
+    max_bytes: the total size of the cached arrays to keep
+    '''
+    def __init__(self, directory, max_bytes = 256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, input_file):
+        '''
+        Returns: the location of the cached events for the file
+        '''
+        name = f'{content_hash(input_file)}-v{READER_VERSION}{CACHE_EXTENSION}'
+        return os.path.join(self.directory, name)
+
+    def read_score(self, input_file, progress = None):
+        '''
+        Reads the note events of a score from the cache, only parsing the score if it isn't cached.
+        progress: passed on to score_reader.read_score if the score is parsed
+        Returns: an array of NOTE_EVENT records in order of offset
+        '''
+        path = self.path(input_file)
+        events = self.get(path)
+        if events is None:
+            events = read_score(input_file, progress)
+            self.put(path, events)
+        return events
+
+    def get(self, path):
+        try:
+            events = np.load(path, allow_pickle = False)
+        except (OSError, ValueError):
+            # missing, evicted or half-written by a process that died
+            self.misses += 1
+            return None
+        if events.dtype != NOTE_EVENT:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return events
+
+    def put(self, path, events):
+        os.makedirs(self.directory, exist_ok = True)
+        handle, temp_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                np.save(temp_file, events, allow_pickle = False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits in max_bytes.
+        '''
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(CACHE_EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
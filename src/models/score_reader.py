@@ -0,0 +1,224 @@
+'''
+Reads sheet music files into compact arrays of note events. MusicXML and Standard MIDI files are read
+directly, without building a music21 score; other formats fall back to music21.
+'''
+import os
+import zipfile
+from fractions import Fraction
+from xml.etree.ElementTree import iterparse, parse
+import numpy as np
+
+# bump this whenever a reader changes the events it produces, so cached scores are read again
+READER_VERSION = 1
+
+NOTE_EVENT = np.dtype([('offset', np.float64), ('midi', np.int16), ('duration', np.float64)])
+
+MUSICXML_EXTENSIONS = ('.musicxml', '.xml')
+COMPRESSED_MUSICXML_EXTENSIONS = ('.mxl',)
+MIDI_EXTENSIONS = ('.mid', '.midi')
+
+STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+# MIDI onsets are snapped to this many divisions of a quarter note, which fits both duple and
+# triplet rhythms
+MIDI_GRID = 12
+PERCUSSION_CHANNEL = 9
+# the MIDI reader reports its progress once per this many events
+PROGRESS_EVENTS = 4096
+
+def make_events(rows):
+    '''
+    Builds an event array from (offset, midi, duration) tuples, sorted by offset. Notes at the same
+    offset keep their original order.
+    '''
+    events = np.array(rows, dtype = NOTE_EVENT)
+    return events[np.argsort(events['offset'], kind = 'stable')]
+
+def read_score(input_file, progress = None):
+    '''
+    Reads the notes of a score, using the fast readers where the format allows it.
+    progress: a function the fast readers call with (bytes read, total bytes) as they go; it can
+    raise an exception to stop reading. music21 can't be interrupted, so it isn't called there.
+    Returns: an array of NOTE_EVENT records in order of offset
+    '''
+    extension = os.path.splitext(input_file)[1].lower()
+    try:
+        if extension in MUSICXML_EXTENSIONS:
+            return read_musicxml(input_file, progress)
+        if extension in COMPRESSED_MUSICXML_EXTENSIONS:
+            return read_compressed_musicxml(input_file, progress)
+        if extension in MIDI_EXTENSIONS:
+            return read_midi(input_file, progress)
+    except UnsupportedScoreError:
+        pass
+    return read_music21(input_file)
+
+class UnsupportedScoreError(Exception):
+    '''
+    Raised by the fast readers for valid files that they don't handle, so that music21 is used.
+    '''
+
+def read_music21(input_file):
+    '''
+    Reads any format music21 understands, at the cost of building the full score.
+    '''
+    from music21 import converter # pylint: disable=import-outside-toplevel
+    song_components = ['Note', 'Chord']
+    notes = converter.parse(input_file).flatten().getElementsByClass(song_components)
+    return make_events([(float(n.offset), p.midi, float(n.quarterLength))
+                        for n in notes
+                        for p in n.pitches])
+
+def read_compressed_musicxml(input_file, progress = None):
+    with zipfile.ZipFile(input_file) as archive:
+        container = parse(archive.open('META-INF/container.xml'))
+        rootfile = container.find('.//rootfile')
+        if rootfile is None:
+            raise UnsupportedScoreError(input_file)
+        path = rootfile.get('full-path')
+        with archive.open(path) as source:
+            return read_musicxml(source, progress, archive.getinfo(path).file_size)
+
+def read_musicxml(source, progress = None, size = 0):
+    '''
+    Reads a partwise MusicXML file incrementally, discarding each measure once it has been read.
+    source: a file name or a binary file object
+    progress: a function called with (bytes read, size) after each measure; it can raise an
+    exception to stop reading
+    size: the number of bytes in the file object; found from the file when given a file name
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as score_file:
+            return read_musicxml(score_file, progress, os.fstat(score_file.fileno()).st_size)
+
+    rows = []
+    divisions = 1
+    measure_start = Fraction(0)
+    position = Fraction(0)
+    last_onset = Fraction(0)
+    measure_length = Fraction(0)
+
+    for event, elem in iterparse(source, events = ('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'score-timewise':
+                raise UnsupportedScoreError(source)
+            if tag == 'part':
+                measure_start = Fraction(0)
+            elif tag == 'measure':
+                position = Fraction(0)
+                last_onset = Fraction(0)
+                measure_length = Fraction(0)
+            continue
+
+        if tag == 'divisions':
+            divisions = int(float(elem.text))
+        elif tag == 'note':
+            duration = Fraction(int(float(elem.findtext('duration', '0'))), divisions)
+            is_chord = elem.find('chord') is not None
+            onset = last_onset if is_chord else position
+            pitch = elem.find('pitch')
+            if pitch is not None and elem.find('grace') is None and elem.find('cue') is None:
+                midi = ((int(pitch.findtext('octave')) + 1) * 12 + STEPS[pitch.findtext('step')]
+                        + round(float(pitch.findtext('alter', '0'))))
+                rows.append((float(measure_start + onset), midi, float(duration)))
+            if not is_chord and elem.find('grace') is None:
+                last_onset = position
+                position += duration
+                measure_length = max(measure_length, position)
+        elif tag == 'backup':
+            position -= Fraction(int(float(elem.findtext('duration', '0'))), divisions)
+        elif tag == 'forward':
+            position += Fraction(int(float(elem.findtext('duration', '0'))), divisions)
+            measure_length = max(measure_length, position)
+        elif tag == 'measure':
+            measure_start += measure_length
+            elem.clear()
+            if progress is not None:
+                progress(source.tell(), size)
+
+    return make_events(rows)
+
+def read_variable_length(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def read_midi(input_file, progress = None):
+    '''
+    Reads the notes of a Standard MIDI file, pairing each note-on with its note-off. Percussion is
+    skipped, and onsets and durations are snapped to MIDI_GRID.
+    progress: a function called with (bytes read, total bytes) every PROGRESS_EVENTS events; it
+    can raise an exception to stop reading
+    '''
+    with open(input_file, 'rb') as midi_file:
+        data = midi_file.read()
+    if data[:4] != b'MThd':
+        raise UnsupportedScoreError(input_file)
+
+    header_length = int.from_bytes(data[4:8], 'big')
+    division = int.from_bytes(data[12:14], 'big', signed = True)
+    if division <= 0:
+        # SMPTE timing has no notion of quarter notes
+        raise UnsupportedScoreError(input_file)
+
+    def quantize(ticks):
+        return round(ticks * MIDI_GRID / division) / MIDI_GRID
+
+    rows = []
+    events = 0
+    pos = 8 + header_length
+    while pos + 8 <= len(data):
+        chunk_type = data[pos:pos + 4]
+        chunk_end = pos + 8 + int.from_bytes(data[pos + 4:pos + 8], 'big')
+        pos += 8
+        if chunk_type != b'MTrk':
+            pos = chunk_end
+            continue
+
+        tick = 0
+        status = None
+        held = {}
+        while pos < chunk_end:
+            events += 1
+            if progress is not None and events % PROGRESS_EVENTS == 0:
+                progress(pos, len(data))
+            delta, pos = read_variable_length(data, pos)
+            tick += delta
+            byte = data[pos]
+            if byte == 0xFF:
+                length, pos = read_variable_length(data, pos + 2)
+                pos += length
+                continue
+            if byte in (0xF0, 0xF7):
+                length, pos = read_variable_length(data, pos + 1)
+                pos += length
+                continue
+            if byte & 0x80:
+                status = byte
+                pos += 1
+
+            kind = status & 0xF0
+            channel = status & 0x0F
+            if kind in (0xC0, 0xD0):
+                pos += 1
+                continue
+            key, velocity = data[pos], data[pos + 1]
+            pos += 2
+            if channel == PERCUSSION_CHANNEL:
+                continue
+
+            if kind == 0x90 and velocity > 0:
+                held.setdefault((channel, key), []).append(tick)
+            elif kind in (0x80, 0x90) and held.get((channel, key)):
+                start = held[(channel, key)].pop(0)
+                rows.append((quantize(start), key, quantize(tick) - quantize(start)))
+
+        for (_, key), starts in held.items():
+            rows.extend((quantize(start), key, quantize(tick) - quantize(start)) for start in starts)
+        pos = chunk_end
+
+    return make_events(rows)
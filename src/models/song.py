@@ -0,0 +1,50 @@
+'''
+Defines the Song class, the compact form of a score that the Transcriber works on.
+'''
+import numpy as np
+
+SONG_NOTE = np.dtype([('offset', np.float64), ('midi', np.int16), ('duration', np.float64),
+                      ('chord_id', np.int32)])
+
+class Song:
+    '''
+    The notes of a score grouped into interned chords.
+    notes: an array of SONG_NOTE records in order of offset, already transposed; the chord_id of
+    each note is that of its chord in chord_ids, so a note dropped by the reduction still points to
+    the reduced chord
+    chord_ids: the id of each chord in the song, in order, from the chord table; when chords are
+    reduced to what the guitar can play, these are the ids of the reductions
+    chord_offsets: the offset of each chord
+    chord_table: the ChordTable the ids refer to
+    '''
+    def __init__(self, notes, chord_ids, chord_offsets, chord_table):
+        self.notes = notes
+        self.chord_ids = chord_ids
+        self.chord_offsets = chord_offsets
+        self.chord_table = chord_table
+
+    @classmethod
+    def from_events(cls, events, chord_table, transpose_steps = 0):
+        '''
+        Groups note events that share an offset into chords.
+        events: an array of NOTE_EVENT records in order of offset, as returned by read_score
+        chord_table: the ChordTable to intern the chords in
+        '''
+        notes = np.empty(len(events), dtype = SONG_NOTE)
+        notes['offset'] = events['offset']
+        notes['midi'] = events['midi'] + transpose_steps
+        notes['duration'] = events['duration']
+
+        is_start = np.ones(len(notes), dtype = bool)
+        is_start[1:] = notes['offset'][1:] != notes['offset'][:-1]
+        starts = np.flatnonzero(is_start)
+
+        midi = notes['midi'].tolist()
+        bounds = starts.tolist() + [len(notes)]
+        chord_ids = np.array([chord_table.intern(midi[start:end])
+                              for start, end in zip(bounds, bounds[1:])], dtype = np.int32)
+        notes['chord_id'] = chord_ids[np.cumsum(is_start) - 1]
+        return cls(notes, chord_ids, notes['offset'][starts], chord_table)
+
+    def __len__(self):
+        return len(self.chord_ids)
@@ -0,0 +1,112 @@
+'''
+Defines the Stats class, which collects the time and memory spent in each stage of a transcription and
+counts of the work done along the way, and the CacheCounts base class for the caches' hit counts.
+'''
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# shared by every disabled stage, so that timing nothing costs no more than a with statement
+_NO_STAGE = nullcontext()
+
+def stage(stats, name):
+    '''
+    Times a stage if stats is a Stats object; does nothing if it's None.
+    Usage: with stage(self.stats, 'read_score'): ...
+    '''
+    if stats is None:
+        return _NO_STAGE
+    return stats.stage(name)
+
+class CacheCounts:
+    '''
+    The hit and miss counts of a cache, shared by the caches the Transcriber reports on.
+    hits, misses: how many lookups have been answered or missed by this cache object
+    '''
+    hits = 0
+    misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+class Stats:
+    '''
+    Profiling information for one or more transcriptions. Stages shouldn't be nested when memory is
+    traced, since each stage resets the peak.
+    trace_memory: also measure the peak memory allocated in each stage with tracemalloc, which makes
+    everything run several times slower
+    stages: for each stage, in the order they first ran, a dict with its total 'seconds', the
+    number of 'calls' and, if memory is traced, the largest 'peak_bytes' allocated during a call
+    counters: named counts of the work done
+    '''
+    def __init__(self, trace_memory = False):
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            totals = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            totals['seconds'] += elapsed
+            totals['calls'] += 1
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - start_bytes
+                totals['peak_bytes'] = max(totals.get('peak_bytes', 0), peak)
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, profile):
+        '''
+        Adds another profile, as returned by as_dict(), to this one, such as that of each worker
+        process of a batch. Times, calls and counters are summed, and the larger peak is kept.
+        '''
+        for name, totals in profile['stages'].items():
+            own_totals = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            own_totals['seconds'] += totals['seconds']
+            own_totals['calls'] += totals['calls']
+            if 'peak_bytes' in totals:
+                own_totals['peak_bytes'] = max(own_totals.get('peak_bytes', 0),
+                                               totals['peak_bytes'])
+        for name, value in profile['counters'].items():
+            self.count(name, value)
+
+    def close(self):
+        '''
+        Stops tracing memory, if this object started it.
+        '''
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def as_dict(self):
+        return {'stages': self.stages, 'counters': dict(sorted(self.counters.items()))}
+
+    def __str__(self):
+        lines = ['stage                 seconds  calls' + ('    peak MiB' if self.trace_memory else '')]
+        for name, totals in self.stages.items():
+            line = f'{name:<20} {totals["seconds"]:8.3f} {totals["calls"]:6}'
+            if 'peak_bytes' in totals:
+                line += f' {totals["peak_bytes"] / 2**20:11.2f}'
+            lines.append(line)
+        lines.append('')
+        lines.extend(f'{name:<40} {value:>12}' for name, value in sorted(self.counters.items()))
+        return '\n'.join(lines)
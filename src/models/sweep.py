@@ -0,0 +1,160 @@
+'''
+Defines the ConfigSweep class, which transcribes one score with many TranscriberConfigs and ranks them
+by the total cost of their tabs, to pick the tuning and weights that suit a song best.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Tabify.src.models.fingering import Fingering
+from Tabify.src.models.guitar import NOTE_NAMES, OCTAVE, TUNINGS
+from Tabify.src.models.optimizer import Optimizer
+from Tabify.src.models.tab import Tab
+from Tabify.src.models.transcriber import Transcriber
+from Tabify.src.models.transcriber_configs import TranscriberConfigs, BEAM_SEARCH
+
+def describe_configs(configs):
+    '''
+    Returns: a short description of the tuning, frets and weights of the configs
+    '''
+    guitar = configs.guitar
+    tuning = ' '.join(NOTE_NAMES[t % OCTAVE] for t in guitar.tuning_midi)
+    return (f'{tuning}, {guitar.num_frets} frets, stretch {configs.stretch_weight:g}, '
+            f'transition {configs.transition_weight:g}')
+
+def sweep_configs(tuning_names, stretch_weights, base_configs = None):
+    '''
+    Builds the configs for every combination of the named tunings and stretch weights, with the
+    transition weight making up the rest of each pair.
+    tuning_names: keys of guitar.TUNINGS
+    base_configs: a dict of the other TranscriberConfigs arguments shared by every configuration
+    Returns: a list of (name, TranscriberConfigs) pairs
+    '''
+    configs = []
+    for tuning_name in tuning_names:
+        tuning, num_strings = TUNINGS[tuning_name]
+        for stretch_weight in stretch_weights:
+            configs.append((f'{tuning_name}, stretch {stretch_weight:g}',
+                            TranscriberConfigs(tuning = tuning, strings = num_strings,
+                                               stretch_wt = stretch_weight,
+                                               transition_wt = round(1 - stretch_weight, 12),
+                                               **(base_configs or {}))))
+    return configs
+
+def guitar_key(configs):
+    '''
+    Returns: what configs must have in common to share a song's chords and fingerings
+    '''
+    guitar = configs.guitar
+    return (tuple(guitar.tuning_midi), guitar.num_frets, guitar.num_strings, guitar.max_fingerings,
+            configs.reduce_chords)
+
+def _solve_group(events, group_configs):
+    '''
+    Prepares the song once for configs that share a guitar, then solves it for each of them; the
+    exact searches are solved together by Optimizer.solve_weights.
+    Returns: the total cost of each configuration, the number of chords without fingerings, and
+    the index and packed path of the cheapest configuration
+    '''
+    transcriber = Transcriber(group_configs[0])
+    transcriber.song = transcriber.prepare_song(events)
+    chord_ids = transcriber.song.chord_ids.tolist()
+    unfingered = sum(1 for chord_id in chord_ids if not transcriber.get_fingerings(chord_id))
+
+    # the transitions are the same whatever the weights, so every solve shares them
+    transition_cache = transcriber.transition_cache
+    solved = [None] * len(group_configs)
+    exact = [i for i, configs in enumerate(group_configs) if configs.search != BEAM_SEARCH]
+    if exact:
+        weights = [(group_configs[i].stretch_weight, group_configs[i].transition_weight)
+                   for i in exact]
+        optimizer = Optimizer(group_configs[0], transition_cache)
+        for i, result in zip(exact, optimizer.solve_weights(chord_ids, transcriber.get_fingerings,
+                                                            weights)):
+            solved[i] = result
+    for i, configs in enumerate(group_configs):
+        if solved[i] is None:
+            solved[i] = Optimizer(configs, transition_cache).solve(chord_ids,
+                                                                   transcriber.get_fingerings)
+
+    costs = [cost for _, cost in solved]
+    best = min(range(len(costs)), key = lambda i: np.inf if costs[i] is None else costs[i])
+    packed_path = [None if f is None else f.to_bytes() for f in solved[best][0]]
+    return costs, unfingered, best, packed_path
+
+class SweepResult:
+    '''
+    How one configuration of a sweep did.
+    name: a description of the configuration
+    cost: the total cost of its tab, or None if no chord could be fingered
+    unfingered: the number of chords it found no fingering for
+    '''
+    def __init__(self, name, configs, cost, unfingered):
+        self.name = name
+        self.configs = configs
+        self.cost = cost
+        self.unfingered = unfingered
+
+    def rank_key(self):
+        # a configuration that leaves chords out isn't better for skipping their costs
+        return (self.unfingered, np.inf if self.cost is None else self.cost)
+
+    def __str__(self):
+        cost = '-' if self.cost is None else f'{self.cost:.2f}'
+        return f'{cost:>12}  {self.unfingered:10}  {self.name}'
+
+def format_table(results):
+    '''
+    Returns: the ranked results as the lines of a table
+    '''
+    lines = [f'rank  {"cost":>12}  {"unfingered":>10}  configuration']
+    lines.extend(f'{rank:4}  {result}' for rank, result in enumerate(results, 1))
+    return '\n'.join(lines)
+
+class ConfigSweep:
+    '''
+    Transcribes a score with each of a list of configurations. The score is read once, the chords
+    and fingerings are shared by configurations with the same guitar, the weightings of each guitar
+    are solved together, and the guitars are spread over a pool of worker processes.
+    configs: a list of (name, TranscriberConfigs) pairs, or of TranscriberConfigs
+    workers: the number of worker processes; 1 runs every configuration in this process
+    '''
+    def __init__(self, configs, workers = 1):
+        self.configs = [c if isinstance(c, tuple) else (describe_configs(c), c) for c in configs]
+        self.workers = max(1, workers)
+
+    def run(self, input_file):
+        '''
+        Returns: the SweepResult of each configuration, best first, and the Tab of the best one
+        '''
+        events = Transcriber(self.configs[0][1]).read_score(input_file)
+        groups = {}
+        for i, (_, configs) in enumerate(self.configs):
+            groups.setdefault(guitar_key(configs), []).append(i)
+        groups = list(groups.values())
+        group_configs = [[self.configs[i][1] for i in group] for group in groups]
+
+        if not len(events):
+            outcomes = [([None] * len(group), 0, 0, []) for group in groups]
+        elif self.workers == 1 or len(groups) == 1:
+            outcomes = [_solve_group(events, configs) for configs in group_configs]
+        else:
+            with ProcessPoolExecutor(max_workers = min(self.workers, len(groups))) as executor:
+                outcomes = list(executor.map(_solve_group, [events] * len(groups), group_configs))
+
+        results = [None] * len(self.configs)
+        best_paths = {}
+        for group, (costs, unfingered, best, packed_path) in zip(groups, outcomes):
+            for i, cost in zip(group, costs):
+                results[i] = SweepResult(*self.configs[i], cost, unfingered)
+            best_paths[group[best]] = packed_path
+
+        ranked = sorted(range(len(results)), key = lambda i: results[i].rank_key())
+        # the top configuration is the cheapest of its guitar, so its path was sent back
+        winner = next(i for i in ranked if i in best_paths)
+        fingerings = [None if data is None else Fingering.from_bytes(data)
+                      for data in best_paths[winner]]
+        winning_configs = self.configs[winner][1]
+        # the offsets of the chords don't depend on the configuration
+        offsets = np.unique(events['offset']).tolist()
+        tab = Tab(fingerings, winning_configs.guitar, offsets = offsets,
+                  measure_length = winning_configs.measure_length)
+        return [results[i] for i in ranked], tab
@@ -1,52 +1,85 @@
 '''
 
 '''
+from itertools import repeat
 from Tabify.src.models.guitar import Guitar
 
+# the text for each fret a Fingering can hold; UNUSED (-1) picks out the '-' at the end
+FRET_LABELS = [str(fret) for fret in range(127)] + ['-']
+
 class Tab:
-    def __init__(self, fingerings, guitar = Guitar(), line_len = 80):
+    '''
+    Guitar tablature for a sequence of fingerings.
+    fingerings: an iterable of Fingering objects, or None for chords that can't be played; it is
+    only read once, so it can be a generator
+    line_len: the width at which the tab is wrapped onto a new set of lines
+    offsets: the offset of each chord in quarter notes, read alongside the fingerings; if given, a
+    barline is drawn before the first chord of each measure
+    measure_length: the length of a measure in quarter notes
+    '''
+    def __init__(self, fingerings, guitar = Guitar(), line_len = 80, offsets = None,
+                 measure_length = 4.0):
         self.fingerings = fingerings
         self.guitar = guitar
         self.line_len = line_len
-    
-    def __tablature(self, fingering):
-        flattened_notes = [note for finger in fingering.fingers.values() for note in finger]
-        is_double_length = len([n for n in flattened_notes if n > 10]) > 0
-        notes = sorted(flattened_notes, key = lambda v: (v[1], -v[0]))
-        result = []
-        for string in range(1, self.guitar.num_strings + 1):
-            str_value = ''
-            if len(notes) > 0 and string == notes[0][1]:
-                str_value = str(notes[0][0])
-                notes = [n for n in notes if n[1] != string]
-            else:
-                str_value = '-'
-            
-            if is_double_length:
-                str_value += '-'
-            result += [str_value]
-
-        return result.reverse()
-    
+        self.offsets = offsets
+        self.measure_length = measure_length
+
+    def column(self, fingering):
+        '''
+        Returns: the text for one fingering on each string, highest string first, all of the
+        same width
+        '''
+        num_strings = self.guitar.num_strings
+        if fingering is None:
+            return ['-'] * num_strings
+        cells = [FRET_LABELS[fret] for fret in reversed(fingering.frets[:num_strings])]
+        width = max(len(c) for c in cells)
+        if width == 1:
+            return cells
+        return [c.ljust(width, '-') for c in cells]
+
+    def lines(self):
+        '''
+        Generates the tab one line at a time, as soon as each set of string lines is full. Each
+        chord is looked at once, so the time taken is linear in the length of the tab.
+        '''
+        header = self.guitar.as_tablature()
+        rows = [[h] for h in header]
+        line_width = len(header[0])
+        next_barline = self.measure_length
+
+        offsets = repeat(0.0) if self.offsets is None else self.offsets
+        for f, offset in zip(self.fingerings, offsets):
+            column = [c + '-' for c in self.column(f)]
+            if offset >= next_barline:
+                next_barline = (offset // self.measure_length + 1) * self.measure_length
+                # the header already ends in a barline
+                if len(rows[0]) > 1:
+                    column = ['|' + c for c in column]
+
+            if line_width + len(column[0]) > self.line_len and len(rows[0]) > 1:
+                yield from (''.join(row) for row in rows)
+                yield ''
+                rows = [[h] for h in header]
+                line_width = len(header[0])
+                column = [c.lstrip('|') for c in column]
+
+            for row, cell in zip(rows, column):
+                row.append(cell)
+            line_width += len(column[0])
+
+        if len(rows[0]) > 1:
+            yield from (''.join(row) for row in rows)
+
+    def write(self, stream):
+        '''
+        Writes the tab to a text stream as it's generated, so only one set of string lines is held
+        in memory at a time.
+        '''
+        for line in self.lines():
+            stream.write(line)
+            stream.write('\n')
+
     def __str__(self):
-        tab_str_lines = self.guitar.as_tablature()
-        completed_line_count = 0
-        for f in self.fingerings:
-            # todo: there will be another loop layer once we have measures implemented
-            # this will be important for finding bar lines
-            fingering_tab = self.__tablature(f)
-            for s in self.guitar.num_strings:
-                # todo: using chord offsets will be vital for determining spacing
-                tab_str_lines[completed_line_count + s] += fingering_tab[s] + '-'
-        
-        # todo: establish barline
-        if False:
-            for s in self.guitar.num_strings:
-                tab_str_lines[completed_line_count + s] += '|'
-        
-        if len(tab_str_lines[completed_line_count]) > self.line_len:
-            # todo: move current measure to next line
-            tab_str_lines += self.guitar.as_tablature()
-            completed_line_count += self.guitar.num_strings
-
-        return '\n'.join(tab_str_lines)
\ No newline at end of file
+        return '\n'.join(self.lines())
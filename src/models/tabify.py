@@ -1,14 +1,20 @@
 '''
 
 '''
-import subprocess
-from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout
-from Tabify.src.views.control_center import ControlCenter
-from Tabify.src.views.score_viewer import ScoreViewer, DEFAULT_PDF_PATH
-from Tabify.src.views.tab_editor import TabEditor
+import json
+import os
+import sys
+from glob import has_magic
+from Tabify.src.models.batch_transcriber import BatchTranscriber, find_input_files
+from Tabify.src.models.pdf_converter import PdfCache, DEFAULT_PDF_CACHE
+from Tabify.src.models.stats import Stats, stage
+from Tabify.src.models.sweep import ConfigSweep, format_table, sweep_configs
 from Tabify.src.models.transcriber import Transcriber
 from Tabify.src.models.transcriber_configs import TranscriberConfigs
 
+SWEEP_TUNINGS = ['standard', 'drop-d', 'dadgad', 'seven-string']
+SWEEP_STRETCH_WEIGHTS = [0.25, 0.5, 0.75]
+
 class Tabify:
     '''
     
@@ -28,33 +34,85 @@ class Tabify:
                 arg_dict['no_gui'] = True
             elif args[i] in ('-f', '--file'):
                 arg_dict['input_file'] = args[i + 1]
+                arg_dict.setdefault('input_files', []).append(args[i + 1])
                 i += 1
             elif args[i] in ('-o', '--output-file'):
                 arg_dict['output_file'] = args[i + 1]
                 i += 1
+            elif args[i] in ('-d', '--output-dir'):
+                arg_dict['output_dir'] = args[i + 1]
+                i += 1
+            elif args[i] in ('-j', '--jobs'):
+                arg_dict['jobs'] = int(args[i + 1])
+                i += 1
+            elif args[i] == '--profile':
+                arg_dict['profile'] = True
+            elif args[i] == '--profile-memory':
+                arg_dict['profile_memory'] = True
+            elif args[i] == '--sweep':
+                arg_dict['sweep'] = True
+            elif args[i] == '--tunings':
+                arg_dict['tunings'] = args[i + 1].split(',')
+                i += 1
+            elif args[i] == '--stretch-weights':
+                arg_dict['stretch_weights'] = [float(w) for w in args[i + 1].split(',')]
+                i += 1
+            elif args[i] == '--reduce-chords':
+                arg_dict['reduce_chords'] = True
+            elif args[i] == '--pdf-cache':
+                arg_dict['pdf_cache'] = args[i + 1]
+                i += 1
+            elif args[i] == '--stats-json':
+                arg_dict['stats_json'] = args[i + 1]
+                i += 1
+            elif args[i] == '--fingering-cache':
+                arg_dict['fingering_cache'] = args[i + 1]
+                i += 1
+            elif args[i] == '--fingering-cache-size':
+                arg_dict['fingering_cache_size'] = int(args[i + 1])
+                i += 1
+            elif args[i] == '--score-cache':
+                arg_dict['score_cache'] = args[i + 1]
+                i += 1
+            elif args[i] == '--score-cache-size':
+                arg_dict['score_cache_size'] = int(args[i + 1])
+                i += 1
             i += 1
 
         return arg_dict
 
     def run(self):
+        '''
+        Returns: the exit status of the program; 1 if any file of a batch failed, 2 if the options
+        can't be used together
+        '''
         if 'help' in self.settings:
             self.usage_screen()
-            return
+            return 0
 
-        if 'no_gui' not in self.settings or not self.settings['no_gui']:
+        if self.settings.get('sweep'):
+            return self.run_sweep()
+        elif 'no_gui' not in self.settings or not self.settings['no_gui']:
             self.run_gui()
         else:
-            self.run_cmdline()
+            return self.run_cmdline()
+        return 0
 
     def run_gui(self):
         '''
         
         '''
-        input_file = None
+        # the GUI and PDF libraries are imported here rather than at the top of the module so that
+        # the command line doesn't pay for loading them
+        # pylint: disable=import-outside-toplevel
+        from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout
+        from Tabify.src.views.control_center import ControlCenter
+        from Tabify.src.views.score_converter import ScoreConverter
+        from Tabify.src.views.score_viewer import ScoreViewer
+        from Tabify.src.views.tab_editor import TabEditor
+
+        input_file = self.settings.get('input_file')
         configs = self.get_transcriber_configs()
-        if 'input_file' in self.settings:
-            input_file = self.settings['input_file']
-            subprocess.run(['mscore3', input_file, '-o', DEFAULT_PDF_PATH], check=True)
 
         app = QApplication()
 
@@ -62,11 +120,23 @@ class Tabify:
         window.setWindowTitle("Tabify")
 
         tab_editor = TabEditor(parent = window)
-        score_viewer = ScoreViewer(parent = window)
-        # todo: hook up a signal-slot for updating the score viewer
+        score_viewer = ScoreViewer(pdf_path = None, parent = window)
+        if input_file is not None:
+            # the score is engraved in the background while the window opens and transcription runs
+            converter = ScoreConverter(input_file,
+                                       PdfCache(self.settings.get('pdf_cache', DEFAULT_PDF_CACHE)),
+                                       window)
+            converter.converted.connect(score_viewer.load_pdf)
+            converter.failed.connect(lambda error: print(f'Could not engrave {input_file}: {error}',
+                                                         file = sys.stderr))
+            converter.start()
 
         control_center = ControlCenter(input_file, configs, window)
+        control_center.started.connect(tab_editor.clearTab)
+        control_center.partiallyTranscribed.connect(tab_editor.appendLines)
         control_center.transcribed.connect(tab_editor.changeTab)
+        control_center.candidatesChanged.connect(tab_editor.setCandidates)
+        tab_editor.fingeringPinned.connect(control_center.pinFingering)
         if input_file is not None:
             control_center.executeTranscriber()
 
@@ -80,21 +150,119 @@ class Tabify:
         app.exec()
 
     def run_cmdline(self):
+        if self.is_batch():
+            return 1 if self.run_batch() else 0
         if 'input_file' in self.settings:
-            transcriber = Transcriber(self.get_transcriber_configs())
-
-            tab = transcriber.transcribe(self.settings['input_file'])
-            if 'output_file' in self.settings:
-                pass # todo: stick str(tab) in the file
-            else:
-                print(str(tab))
+            with Transcriber(self.get_transcriber_configs()) as transcriber:
+                tab = transcriber.transcribe(self.settings['input_file'])
+                with stage(transcriber.stats, 'render'):
+                    if 'output_file' in self.settings:
+                        with open(self.settings['output_file'], 'w') as tab_file:
+                            tab.write(tab_file)
+                    else:
+                        tab.write(sys.stdout)
+            self.report_stats(transcriber.stats)
         else:
             self.usage_screen()
+        return 0
+
+    def run_sweep(self):
+        '''
+        Transcribes the input file with every combination of the --tunings and --stretch-weights,
+        prints the configurations ranked by total cost to stderr and writes the tab of the best one.
+        Returns: the exit status
+        '''
+        if 'input_file' not in self.settings:
+            self.usage_screen()
+            return 0
+        # each configuration is solved outside a Transcriber's stages, so there's nothing to profile
+        profile_options = [option for option, key in (('--profile', 'profile'),
+                                                      ('--profile-memory', 'profile_memory'),
+                                                      ('--stats-json', 'stats_json'))
+                           if key in self.settings]
+        if profile_options:
+            print(f'{", ".join(profile_options)} can\'t be used with --sweep', file = sys.stderr)
+            return 2
+        configs = sweep_configs(self.settings.get('tunings', SWEEP_TUNINGS),
+                                self.settings.get('stretch_weights', SWEEP_STRETCH_WEIGHTS),
+                                {'reduce_chords': self.settings.get('reduce_chords', False)})
+        results, tab = ConfigSweep(configs, self.settings.get('jobs', 1)).run(
+            self.settings['input_file'])
+        print(format_table(results), file = sys.stderr)
+        if 'output_file' in self.settings:
+            with open(self.settings['output_file'], 'w') as tab_file:
+                tab.write(tab_file)
+        else:
+            tab.write(sys.stdout)
+        return 0
+
+    def is_batch(self):
+        '''
+        Batch mode is used when there are several inputs, a directory or glob among them, or an
+        output directory to write them to.
+        '''
+        input_files = self.settings.get('input_files', [])
+        return (len(input_files) > 1
+                or 'output_dir' in self.settings
+                or any(has_magic(f) or os.path.isdir(f) for f in input_files))
+
+    def run_batch(self):
+        '''
+        Transcribes every input file, reporting each one on stderr as it finishes, and then the
+        profile of the whole batch if it's asked for.
+        Returns: the number of files that failed
+        '''
+        input_files = find_input_files(self.settings['input_files'])
+        batch = BatchTranscriber(self.get_transcriber_configs(), self.settings.get('jobs', 1))
+        failures = 0
+        # each worker's profile covers all of its files so far, so only its latest one is kept
+        worker_profiles = {}
+        for result in batch.run(input_files, self.settings.get('output_dir')):
+            if result.error is not None:
+                failures += 1
+            if result.stats is not None:
+                worker, profile = result.stats
+                worker_profiles[worker] = profile
+            print(result, file = sys.stderr, flush = True)
+        print(f'{len(input_files) - failures} of {len(input_files)} files transcribed',
+              file = sys.stderr)
+
+        if worker_profiles:
+            stats = Stats(self.settings.get('profile_memory', False))
+            for profile in worker_profiles.values():
+                stats.add(profile)
+            self.report_stats(stats)
+        return failures
+
+    def report_stats(self, stats):
+        '''
+        Prints the profile of a transcription to stderr and/or writes it to the --stats-json file.
+        '''
+        if stats is None:
+            return
+        stats.close()
+        if self.settings.get('profile') or self.settings.get('profile_memory'):
+            print(stats, file = sys.stderr)
+        if 'stats_json' in self.settings:
+            with open(self.settings['stats_json'], 'w') as stats_file:
+                json.dump(stats.as_dict(), stats_file, indent = 1)
 
     def get_transcriber_configs(self):
         # todo: look for relevant settings in the settings dictionary and pass them into the
         # constructor
-        return TranscriberConfigs()
+        defaults = TranscriberConfigs()
+        return TranscriberConfigs(profile = self.settings.get('profile', False)
+                                            or 'stats_json' in self.settings,
+                                  profile_memory = self.settings.get('profile_memory', False),
+                                  reduce_chords = self.settings.get('reduce_chords', False),
+                                  fingering_cache = self.settings.get('fingering_cache'),
+                                  fingering_cache_size = self.settings.get(
+                                      'fingering_cache_size', defaults.fingering_cache_size),
+                                  score_cache = self.settings.get('score_cache'),
+                                  score_cache_size = self.settings.get('score_cache_size',
+                                                                       defaults.score_cache_size),
+                                  # batches already spread the files over -j processes
+                                  workers = 1 if self.is_batch() else self.settings.get('jobs', 1))
 
     def usage_screen(self):
         pass
@@ -2,22 +2,85 @@
 Defines the Transcriber class, which can use the transcribe() function to convert a sheet music file
 into a Tab object.
 '''
-from music21 import converter
-from Tabify.src.models.chord import Chord
+from copy import copy
+from itertools import tee
+import numpy as np
+from Tabify.src.models.chord import ChordTable
+from Tabify.src.models.fingering_cache import FingeringCache
+from Tabify.src.models.fingering_pool import enumerate_fingerings
+from Tabify.src.models.optimizer import Optimizer, TransitionCache
+from Tabify.src.models.repeats import find_repeats
+from Tabify.src.models.score_cache import ScoreCache
+from Tabify.src.models.score_reader import read_score
+from Tabify.src.models.song import Song
+from Tabify.src.models.stats import Stats, stage
 from Tabify.src.models.tab import Tab
-from Tabify.src.models.transcriber_configs import TranscriberConfigs
+from Tabify.src.models.transcriber_configs import TranscriberConfigs, EXACT_SEARCH, BEAM_SEARCH
 
 # todo: set up the fingering list in a way that can more easily be parsed by the tab object
 
+# the stages reported to progress callbacks, which are timed under the same names in the stats
+READ_STAGE = 'read_score'
+REDUCE_STAGE = 'reduce_chords'
+FINGERINGS_STAGE = 'fingerings'
+OPTIMIZE_STAGE = 'optimize'
+# below this many new chords, starting worker processes costs more than it saves
+PARALLEL_MIN_CHORDS = 128
+# how many note events transcribe_iter turns into Python objects at a time
+STREAM_SLICE = 4096
+
 class Transcriber:
     '''
     A class for converting sheet music files into Tab objects.
     guitar: a Guitar object; defaults to the default Guitar object values
+    optimality_gap: after a beam search with report_gap set, how much more the chosen path costs
+    than the optimal one
+    fingering_cache: the persistent FingeringCache named in the configs, if any
+    score_cache: the persistent ScoreCache named in the configs, if any
+    transition_cache: the TransitionCache shared by every solve, since chord ids don't change
+    chord_table: the ChordTable interning every chord this Transcriber has seen
+    saved_fingerings: the viable fingerings of each chord, keyed by chord id
+    playable_ids: the id of the playable reduction of each chord, keyed by chord id, when the
+    configs ask for chord reduction
+    song: the Song being transcribed
+    pins: the fingerings the user has fixed in the song, as a dict of chord index to the index of
+    the fingering in that chord's list of viable fingerings
+    stats: the Stats collected over every transcription, if the configs ask for profiling
     '''
     def __init__(self, configs = TranscriberConfigs()):
         self.configs = configs
+        self.chord_table = ChordTable()
         self.saved_fingerings = {}
-        self.notes = []
+        self.playable_ids = {}
+        self.song = None
+        self.pins = {}
+        self.optimizer = None
+        self.optimality_gap = None
+        self.fingering_cache = None
+        if configs.fingering_cache is not None:
+            self.fingering_cache = FingeringCache(configs.fingering_cache,
+                                                  configs.fingering_cache_size)
+        self.score_cache = None
+        if configs.score_cache is not None:
+            self.score_cache = ScoreCache(configs.score_cache, configs.score_cache_size)
+        self.transition_cache = TransitionCache(configs.transition_cache_size)
+        self.stats = None
+        if configs.profile or configs.profile_memory:
+            self.stats = Stats(configs.profile_memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''
+        Closes the fingering cache, writing out the lookups it has pending and evicting anything
+        over its cap. It's opened again if the Transcriber is used again.
+        '''
+        if self.fingering_cache is not None:
+            self.fingering_cache.close()
 
     def transcribe(self, input_file):
         '''
@@ -25,73 +88,309 @@ class Transcriber:
         transcription process.
         song: a valid file location of one of the following formats:
         '''
-        song_components = ['Note', 'Chord']
-        notes = converter.parse(input_file).flatten().getElementsByClass(song_components)
-        if not notes:
-            return []
-        self.notes = self.prepare_song(notes)
+        with stage(self.stats, READ_STAGE):
+            events = self.read_score(input_file)
+        if not len(events):
+            self.song = None
+            return Tab([], self.configs.guitar)
+        self.song = self.prepare_song(events)
         results = self.evaluate_song()
-        return Tab(results, self.configs.guitar)
+        self.count_cache_stats()
+        return self.make_tab(results)
+
+    def make_tab(self, fingerings):
+        '''
+        Returns: a Tab of the given fingerings of the chords of the song, with its barlines
+        '''
+        return Tab(fingerings, self.configs.guitar, offsets = self.song.chord_offsets.tolist(),
+                   measure_length = self.configs.measure_length)
+
+    def transcribe_iter(self, input_file):
+        '''
+        Streaming version of transcribe(). The score is passed through a pipeline of generators
+        (note events, chords, fingering candidates, online optimization, tab lines), and the
+        fingering of each chord is committed once configs.lookahead more chords have been read, so
+        the tab is produced as the song is read. No Song is kept, so fingerings can't be pinned
+        afterwards; use transcribe() for that.
+        Returns: a generator of the lines of the tab
+        '''
+        with stage(self.stats, READ_STAGE):
+            events = self.read_score(input_file)
+        with stage(self.stats, 'transpose'):
+            transpose_steps = self.get_transposition(events)
+        self.song = None
+        self.pins = {}
+        # the offsets are read about configs.lookahead chords behind the chord ids, which is all
+        # that tee holds on to
+        id_chords, offset_chords = tee(self.score_chords(events, transpose_steps))
+        chord_ids = (self.playable_chord_id(self.chord_table.intern(chord))
+                     for _, chord in id_chords)
+        offsets = (offset for offset, _ in offset_chords)
+
+        self.optimizer = Optimizer(self.configs, self.transition_cache)
+        fingerings = self.optimizer.solve_online(chord_ids, self.get_fingerings,
+                                                 self.configs.lookahead)
+        return Tab(fingerings, self.configs.guitar, offsets = offsets,
+                   measure_length = self.configs.measure_length).lines()
+
+    def read_score(self, input_file, progress = None):
+        '''
+        Reads the note events of a score, through the score cache if there is one.
+        progress: a function called with (READ_STAGE, bytes read, total bytes) as the score is
+        parsed; it can raise an exception to stop the transcription
+        '''
+        def read_progress(done, total):
+            progress(READ_STAGE, done, total)
+        reader_progress = None if progress is None else read_progress
+
+        if self.score_cache is not None:
+            return self.score_cache.read_score(input_file, reader_progress)
+        return read_score(input_file, reader_progress)
+
+    def score_chords(self, events, transpose_steps = 0):
+        '''
+        Groups the notes of a score into chords, STREAM_SLICE events at a time, so only one slice
+        of the array is turned into Python objects at once. A chord cut off by the end of a slice
+        is finished in the next one.
+        events: an array of NOTE_EVENT records in order of offset, as returned by read_score
+        Yields: the offset and the transposed MIDI numbers of each chord
+        '''
+        chord = []
+        current_offset = None
+        for start in range(0, len(events), STREAM_SLICE):
+            piece = events[start:start + STREAM_SLICE]
+            offsets = piece['offset']
+            midi = piece['midi'].tolist()
+            bounds = [0] + (np.flatnonzero(offsets[1:] != offsets[:-1]) + 1).tolist()
+            bounds.append(len(piece))
+            for low, high in zip(bounds, bounds[1:]):
+                offset = float(offsets[low])
+                if chord and offset != current_offset:
+                    yield current_offset, chord
+                    chord = []
+                current_offset = offset
+                chord.extend(m + transpose_steps for m in midi[low:high])
+
+        if chord:
+            yield current_offset, chord
 
     def evaluate_song(self):
-        optimal_paths = []
-
-        for chord in self.notes:
-            if not optimal_paths:
-                optimal_paths = [([f], self.configs.stretch_weight * f.stretch_cost)
-                                 for f
-                                 in self.saved_fingerings[str(Chord(chord))]]
-                continue
-
-            new_optimal_paths = []
-            for fingering in self.saved_fingerings[str(Chord(chord))]:
-                new_optimal_path = ()
-                for path in optimal_paths:
-                    new_path = (path[0] + [fingering],
-                                path[1] +
-                                self.configs.transition_weight * path[0][-1].transition(fingering) +
-                                self.configs.stretch_weight * fingering.stretch_cost)
-                    if not new_optimal_path or new_path[1] < new_optimal_path[1]:
-                        new_optimal_path = new_path
-                new_optimal_paths.append(new_optimal_path)
-
-            optimal_paths = new_optimal_paths
-        return min(optimal_paths, key = lambda p: p[1])[0]
-
-    def prepare_song(self, notes):
-        '''
-        
-        '''
-        prepared_notes = []
-        idx = 0
-        current_offset = 0
-        transpose_steps = self.configs.guitar.get_transposition(notes)
-        for note in notes:
-            if note.isChord:
-                new_notes = [n.transpose(transpose_steps) for n in note.notes]
-            else:
-                new_notes = [note.transpose(transpose_steps)]
-
-            if len(prepared_notes) == 0:
-                prepared_notes.append(new_notes)
-                current_offset = note.offset
-            elif current_offset != note.offset:
-                # gather all viable fingerings for all the chords in the song
-                # todo: self.configs.guitar.make_chord_playable(prepared_notes[idx])
-                new_chord = Chord(prepared_notes[idx])
-                if new_chord not in self.saved_fingerings:
-                    new_fingerings = self.configs.guitar.get_fingerings(prepared_notes[idx])
-                    self.saved_fingerings[str(new_chord)] = new_fingerings
-
-                idx += 1
-                current_offset = note.offset
-                prepared_notes.append(new_notes)
-            else:
-                prepared_notes[idx].extend(new_notes)
-
-        final_chord = Chord(prepared_notes[idx])
-        if final_chord not in self.saved_fingerings:
-            final_fingerings = self.configs.guitar.get_fingerings(prepared_notes[idx])
-            self.saved_fingerings[str(final_chord)] = final_fingerings
-
-        return prepared_notes
+        '''
+        Finds the least difficult sequence of fingerings for the prepared song.
+        Returns: a list with the chosen Fingering object for each chord
+        '''
+        chord_ids = self.song.chord_ids.tolist()
+        segments = ()
+        if self.configs.min_repeat_length:
+            with stage(self.stats, 'find_repeats'):
+                segments = find_repeats(chord_ids, self.configs.min_repeat_length)
+        self.optimizer = Optimizer(self.configs, self.transition_cache)
+        with stage(self.stats, OPTIMIZE_STAGE):
+            path, cost = self.optimizer.solve(chord_ids, self.get_fingerings, segments)
+        if self.stats is not None:
+            self.stats.count('dp.edges', self.optimizer.edges)
+            self.stats.count('repeats.segments', len(segments))
+            self.stats.count('repeats.reused_layers', self.optimizer.reused)
+
+        self.optimality_gap = None
+        if self.configs.search == BEAM_SEARCH and self.configs.report_gap:
+            exact_configs = copy(self.configs)
+            exact_configs.search = EXACT_SEARCH
+            with stage(self.stats, 'optimize_exact'):
+                exact_optimizer = Optimizer(exact_configs, self.transition_cache)
+                _, exact_cost = exact_optimizer.solve(chord_ids, self.get_fingerings, segments)
+            self.optimality_gap = cost - exact_cost
+        return path
+
+    def pin_fingering(self, chord_index, fingering_index):
+        '''
+        Forces the fingering of one chord of the song and re-solves around it. The forward and
+        backward costs of the last full solve are reused, so only the chords between this pin and
+        its neighbouring pins are searched again.
+        fingering_index: the index of the fingering in the chord's list of viable fingerings
+        Returns: the new Tab
+        '''
+        self.check_song()
+        chord_id = int(self.song.chord_ids[chord_index])
+        if not 0 <= fingering_index < len(self.get_fingerings(chord_id)):
+            raise IndexError(f'Chord {chord_index} has no fingering {fingering_index}')
+        self.pins[chord_index] = fingering_index
+        return self.solve_pinned()
+
+    def unpin_fingering(self, chord_index):
+        '''
+        Lets the optimizer choose the fingering of a chord again.
+        Returns: the new Tab
+        '''
+        self.pins.pop(chord_index, None)
+        return self.solve_pinned()
+
+    def check_song(self):
+        '''
+        Raises a RuntimeError if there's no Song to pin fingerings in, as after transcribe_iter()
+        '''
+        if self.song is None:
+            raise RuntimeError('Fingerings can only be pinned in a song prepared by transcribe() '
+                               'or prepare_song()')
+
+    def solve_pinned(self):
+        self.check_song()
+        # the online optimizer doesn't keep the costs a pinned solve needs, so the song is solved in
+        # full once first
+        if self.optimizer is None or self.optimizer.layers is None:
+            self.evaluate_song()
+        with stage(self.stats, 'optimize_pinned'):
+            path, _ = self.optimizer.solve_pinned(self.pins)
+        return self.make_tab(path)
+
+    def evaluate_song_online(self, progress = None):
+        '''
+        Streaming version of evaluate_song() using the online optimizer, so the start of the tab is
+        known long before the end of the song is reached.
+        progress: a function called with (OPTIMIZE_STAGE, chords done, total chords) as each
+        fingering is chosen; it can raise an exception to stop the transcription
+        Yields: the chosen Fingering object for each chord of the prepared song
+        '''
+        self.optimizer = Optimizer(self.configs, self.transition_cache)
+        fingerings = self.optimizer.solve_online(self.song.chord_ids.tolist(), self.get_fingerings,
+                                                 self.configs.lookahead)
+        for done, fingering in enumerate(fingerings, 1):
+            if progress is not None:
+                progress(OPTIMIZE_STAGE, done, len(self.song))
+            yield fingering
+
+    def get_transposition(self, events):
+        '''
+        Returns: how many semitones to shift the notes by to fit them on the guitar
+        '''
+        if not len(events):
+            return 0
+        midi = events['midi']
+        return self.configs.guitar.get_range_transposition(int(midi.min()), int(midi.max()))
+
+    def prepare_song(self, events, progress = None):
+        '''
+        Groups the notes of a song into transposed, interned chords, and then gathers the viable
+        fingerings for each distinct chord.
+        events: an array of NOTE_EVENT records, as returned by read_score
+        progress: a function called with (REDUCE_STAGE or FINGERINGS_STAGE, chords done, total
+        chords) after each distinct chord is reduced and fingered; it can raise an exception to stop
+        the transcription
+        Returns: a Song
+        '''
+        self.pins = {}
+        with stage(self.stats, 'transpose'):
+            transpose_steps = self.get_transposition(events)
+        with stage(self.stats, 'group_chords'):
+            song = Song.from_events(events, self.chord_table, transpose_steps)
+            unique_ids = np.unique(song.chord_ids)
+        if self.configs.reduce_chords:
+            with stage(self.stats, REDUCE_STAGE):
+                playable_ids = np.empty(len(unique_ids), dtype = song.chord_ids.dtype)
+                for done, chord_id in enumerate(unique_ids.tolist()):
+                    playable_ids[done] = self.playable_chord_id(chord_id)
+                    if progress is not None:
+                        progress(REDUCE_STAGE, done + 1, len(unique_ids))
+                if self.stats is not None:
+                    self.stats.count('chords.reduced', int(np.sum(playable_ids != unique_ids)))
+                song.chord_ids = playable_ids[np.searchsorted(unique_ids, song.chord_ids)]
+                song.notes['chord_id'] = playable_ids[np.searchsorted(unique_ids,
+                                                                      song.notes['chord_id'])]
+                unique_ids = np.unique(playable_ids)
+        unique_ids = unique_ids.tolist()
+        with stage(self.stats, FINGERINGS_STAGE):
+            self.gather_fingerings(unique_ids, progress)
+
+        if self.stats is not None:
+            self.stats.count('notes', len(events))
+            self.stats.count('chords', len(song))
+            self.stats.count('chords.unique', len(unique_ids))
+        return song
+
+    def playable_chord_id(self, chord_id):
+        '''
+        Returns: the id of the chord reduced to notes the guitar can play, if the configs ask for
+        chord reduction, or else the chord's own id
+        '''
+        if not self.configs.reduce_chords:
+            return chord_id
+        playable_id = self.playable_ids.get(chord_id)
+        if playable_id is None:
+            playable = self.configs.guitar.make_chord_playable(self.chord_table[chord_id])
+            playable_id = self.playable_ids[chord_id] = self.chord_table.intern(playable)
+        return playable_id
+
+    def gather_fingerings(self, chord_ids, progress = None):
+        '''
+        Makes sure the fingerings of each of the distinct chords are saved. The chords that aren't
+        already known are generated in configs.workers processes when there are enough of them to
+        be worth it, and one at a time in this process otherwise.
+        progress: a function called with (FINGERINGS_STAGE, chords done, total chords) as the
+        fingerings are found, and while waiting for the worker processes; it can raise an exception
+        to stop the transcription
+        '''
+        missing = [i for i in chord_ids if self.lookup_fingerings(i) is None]
+        done = len(chord_ids) - len(missing)
+        if progress is not None and done:
+            progress(FINGERINGS_STAGE, done, len(chord_ids))
+
+        def waiting():
+            progress(FINGERINGS_STAGE, done, len(chord_ids))
+
+        guitar = self.configs.guitar
+        if self.configs.workers > 1 and len(missing) >= PARALLEL_MIN_CHORDS:
+            found = enumerate_fingerings(guitar, [self.chord_table[i] for i in missing],
+                                         self.configs.workers,
+                                         None if progress is None else waiting)
+            if self.stats is not None:
+                self.stats.count('chords.parallel', len(missing))
+        else:
+            found = (guitar.get_fingerings(self.chord_table[i], self.stats) for i in missing)
+
+        for chord_id, fingerings in zip(missing, found):
+            self.save_fingerings(chord_id, fingerings)
+            done += 1
+            if progress is not None:
+                progress(FINGERINGS_STAGE, done, len(chord_ids))
+
+    def get_fingerings(self, chord_id):
+        '''
+        Looks up the viable fingerings for a chord, first in memory, then in the fingering cache,
+        and only generates them if neither has them.
+        chord_id: the id of the chord in the chord table
+        '''
+        fingerings = self.lookup_fingerings(chord_id)
+        if fingerings is None:
+            fingerings = self.configs.guitar.get_fingerings(self.chord_table[chord_id], self.stats)
+            self.save_fingerings(chord_id, fingerings)
+        return fingerings
+
+    def lookup_fingerings(self, chord_id):
+        '''
+        Returns: the fingerings of the chord from memory or the fingering cache, or None if neither
+        has them
+        '''
+        fingerings = self.saved_fingerings.get(chord_id)
+        if fingerings is None and self.fingering_cache is not None:
+            fingerings = self.fingering_cache.get(self.configs.guitar, self.chord_table[chord_id])
+            if fingerings is not None:
+                self.saved_fingerings[chord_id] = fingerings
+        return fingerings
+
+    def save_fingerings(self, chord_id, fingerings):
+        self.saved_fingerings[chord_id] = fingerings
+        if self.fingering_cache is not None:
+            self.fingering_cache.put(self.configs.guitar, self.chord_table[chord_id], fingerings)
+
+    def count_cache_stats(self):
+        '''
+        Copies the running totals of the caches into the stats, if they're collected.
+        '''
+        if self.stats is None:
+            return
+        for name, cache in (('fingering_cache', self.fingering_cache),
+                            ('score_cache', self.score_cache),
+                            ('transition_cache', self.transition_cache)):
+            if cache is not None:
+                self.stats.counters[name + '.hits'] = cache.hits
+                self.stats.counters[name + '.misses'] = cache.misses
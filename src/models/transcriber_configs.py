@@ -1,9 +1,64 @@
 from Tabify.src.models.guitar import Guitar
+from Tabify.src.models.repeats import MIN_REPEAT_LENGTH
+
+EXACT_SEARCH = 'exact'
+BEAM_SEARCH = 'beam'
 
 class TranscriberConfigs:
-    def __init__(self, tuning = None, strings = 6, frets = 15, stretch_wt = 0.5, transition_wt = 0.5):
+    '''
+    Settings for a Transcriber.
+    search: EXACT_SEARCH to find the optimal fingering path, or BEAM_SEARCH to only keep the best
+    beam_width paths (and/or those within beam_threshold of the best) at each chord
+    report_gap: in beam search, also run the exact search to measure how far off the result is
+    fingering_cache: the path of a FingeringCache database to reuse fingerings across runs, if any
+    fingering_cache_size: the number of chords the fingering cache keeps
+    max_fingerings_per_chord: if set, only this many of the easiest fingerings of each chord are
+    considered
+    lookahead: how many chords transcribe_iter reads past a chord before committing to its fingering
+    score_cache: the directory of a ScoreCache to reuse parsed scores across runs, if any
+    score_cache_size: the number of bytes the score cache keeps
+    profile: collect the time spent in each stage and counts of the work done in Transcriber.stats
+    measure_length: the length of a measure in quarter notes, for placing barlines in the tab
+    profile_memory: also measure the memory allocated in each stage, which is much slower
+    transition_cache_size: the number of bytes of transition matrices between chords to keep
+    workers: the number of processes to generate the fingerings of a song's chords in; songs with
+    only a few new chords are always done in this process
+    reduce_chords: drop and move notes of chords that can't be played as written, such as dense
+    piano voicings, instead of leaving them without fingerings
+    min_repeat_length: in exact search, the fewest chords a repeated passage needs for its solution
+    to be reused wherever it comes round the same way; 0 searches every chord
+    '''
+    def __init__(self, tuning = None, strings = 6, frets = 15, stretch_wt = 0.5, transition_wt = 0.5,
+                 search = EXACT_SEARCH, beam_width = None, beam_threshold = None, report_gap = False,
+                 fingering_cache = None, fingering_cache_size = 100000, max_fingerings_per_chord = None,
+                 lookahead = 32, score_cache = None, score_cache_size = 256 * 2**20,
+                 profile = False, profile_memory = False, measure_length = 4.0,
+                 reduce_chords = False, workers = 1, transition_cache_size = 64 * 2**20,
+                 min_repeat_length = MIN_REPEAT_LENGTH):
         if stretch_wt + transition_wt != 1.0:
             raise ValueError("Transcriber weights don't add up to 1")
-        self.guitar = Guitar(tuning, frets, strings)
+        if search not in (EXACT_SEARCH, BEAM_SEARCH):
+            raise ValueError(f"Unknown search mode '{search}'")
+        if search == BEAM_SEARCH and beam_width is None and beam_threshold is None:
+            raise ValueError("Beam search needs a beam width or a cost threshold")
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("Beam width must be at least 1")
+        self.guitar = Guitar(tuning, frets, strings, max_fingerings_per_chord)
         self.stretch_weight = stretch_wt
         self.transition_weight = transition_wt
+        self.search = search
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
+        self.report_gap = report_gap
+        self.fingering_cache = fingering_cache
+        self.fingering_cache_size = fingering_cache_size
+        self.lookahead = lookahead
+        self.score_cache = score_cache
+        self.score_cache_size = score_cache_size
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self.measure_length = measure_length
+        self.reduce_chords = reduce_chords
+        self.workers = max(1, workers)
+        self.transition_cache_size = transition_cache_size
+        self.min_repeat_length = min_repeat_length
@@ -1,30 +1,138 @@
 '''
 
 '''
-from PyQt5.QtWidgets import QWidget
-from PyQt5.QtCore import pyqtSignal
-from Tabify.src.models.transcriber import Transcriber
+import sys
+from PyQt5.QtWidgets import QApplication, QHBoxLayout, QProgressBar, QPushButton, QWidget
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from Tabify.src.models.transcriber_configs import TranscriberConfigs
 from Tabify.src.models.tab import Tab
+from Tabify.src.views.transcription_worker import TranscriptionWorker
 
 class ControlCenter(QWidget):
     '''
     
+    transcribed: emitted with the finished tab of a transcription
+    started: emitted when a transcription starts, before any of its partial lines
+    partiallyTranscribed: emitted with the lines of tab added while a transcription is running
+    progressed: emitted with the stage, chords done and total chords of a running transcription
+    candidatesChanged: emitted with the viable fingerings of each chord of a finished transcription,
+    which can be pinned, or with an empty list when a new one starts
+    transcriber: the Transcriber of the last finished transcription, which pins are made in
     '''
     transcribed = pyqtSignal(Tab)
+    started = pyqtSignal()
+    partiallyTranscribed = pyqtSignal(object)
+    progressed = pyqtSignal(str, int, int)
+    candidatesChanged = pyqtSignal(object)
     def __init__(self, input_file = None, configs = TranscriberConfigs(), parent = None):
         super(ControlCenter, self).__init__(parent)
         self.input_file = input_file
-        self.transcriber = Transcriber(configs)
+        self.configs = configs
+        self.transcriber = None
+        self.worker = None
         self.setupInterface()
+        QApplication.instance().aboutToQuit.connect(self.stopWorkers)
     
     def setupInterface(self):
         # todo: set up file selector, slider for weights, number inputs for frets/strings, and
         # either a series of dropdowns or some radio buttons/checkboxes for tunings.
         # we'll have to figure out how to arrange them pleasantly.
-        pass
+        self.progress_bar = QProgressBar()
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancelTranscriber)
+        self.progressed.connect(self.showProgress)
+
+        layout = QHBoxLayout(self)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+
+    @pyqtSlot(str, int, int)
+    def showProgress(self, stage, done, total):
+        self.progress_bar.setFormat(f'{stage}: %p%')
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+
+    def setRunning(self, running):
+        self.cancel_button.setEnabled(running)
+        if not running:
+            self.progress_bar.reset()
 
     # todo: this is a slot for a buttonClicked signal
     def executeTranscriber(self):
-        tab = self.transcriber.transcribe(self.input_file)
-        self.transcribed.emit(tab)
\ No newline at end of file
+        '''
+        Starts transcribing the input file in the background, cancelling any transcription that's
+        still running.
+        '''
+        self.cancelTranscriber()
+        self.worker = TranscriptionWorker(self.configs, self.input_file, self)
+        self.worker.progress.connect(self.onProgress)
+        self.worker.partial.connect(self.onPartial)
+        self.worker.transcribed.connect(self.onTranscribed)
+        self.worker.failed.connect(self.onFailed)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.start()
+        self.setRunning(True)
+        self.started.emit()
+        self.candidatesChanged.emit([])
+
+    @pyqtSlot()
+    def cancelTranscriber(self):
+        '''
+        Stops the running transcription and throws away its results, without waiting for it. The
+        worker stops at its next progress report and deletes itself once it has.
+        '''
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        self.worker = None
+        self.setRunning(False)
+
+    @pyqtSlot()
+    def stopWorkers(self):
+        '''
+        Cancels every worker that's still running and waits for them, so that none is destroyed
+        with its thread still running when the application quits.
+        '''
+        self.cancelTranscriber()
+        for worker in self.findChildren(TranscriptionWorker):
+            worker.cancel()
+            worker.wait()
+
+    # signals that were queued before a worker was cancelled are still delivered, so each slot
+    # checks that they came from the current one
+    @pyqtSlot(str, int, int)
+    def onProgress(self, stage, done, total):
+        if self.sender() is self.worker:
+            self.progressed.emit(stage, done, total)
+
+    @pyqtSlot(object)
+    def onPartial(self, lines):
+        if self.sender() is self.worker:
+            self.partiallyTranscribed.emit(lines)
+
+    @pyqtSlot(Tab)
+    def onTranscribed(self, tab):
+        if self.sender() is self.worker:
+            self.transcriber = self.worker.transcriber
+            self.worker = None
+            self.setRunning(False)
+            self.transcribed.emit(tab)
+            self.candidatesChanged.emit([self.transcriber.get_fingerings(chord_id)
+                                         for chord_id in self.transcriber.song.chord_ids.tolist()])
+
+    @pyqtSlot(int, int)
+    def pinFingering(self, chord_index, fingering_index):
+        '''
+        Fixes the fingering of a chord of the finished transcription and re-optimizes around it.
+        '''
+        if self.worker is not None or self.transcriber is None or self.transcriber.song is None:
+            return
+        self.transcribed.emit(self.transcriber.pin_fingering(chord_index, fingering_index))
+
+    @pyqtSlot(str)
+    def onFailed(self, error):
+        if self.sender() is self.worker:
+            self.worker = None
+            self.setRunning(False)
+            print(f'Could not transcribe {self.input_file}: {error}', file = sys.stderr)
@@ -0,0 +1,40 @@
+'''
+Defines the ScoreConverter class, which makes the PDF of a score for the score viewer in a
+background thread.
+'''
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class ScoreConverter(QObject):
+    '''
+    Runs a PdfCache conversion off the GUI thread. A score that's already cached is reported as soon
+    as start() is called.
+    converted: emitted with the path of the PDF
+    failed: emitted with a description of the error
+    '''
+    converted = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, input_file, pdf_cache, parent = None):
+        super(ScoreConverter, self).__init__(parent)
+        self.input_file = input_file
+        self.pdf_cache = pdf_cache
+        self.thread = None
+
+    def start(self):
+        pdf_path = self.pdf_cache.get(self.input_file)
+        if pdf_path is not None:
+            self.converted.emit(pdf_path)
+            return
+
+        # signals emitted from the worker are queued to the thread this object lives in
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            pdf_path = self.pdf_cache.convert(self.input_file)
+        except Exception as e: # pylint: disable=broad-except
+            self.failed.emit(repr(e))
+            return
+        self.converted.emit(pdf_path)
@@ -1,16 +1,120 @@
 '''
-
+Defines the ScoreViewer class, which shows the pages of a score's PDF. Pages are only rasterized once
+they're on or near the screen, in a background thread, and kept in a size-limited cache.
 '''
+import threading
+from collections import OrderedDict
 import fitz
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget, QScrollArea
+from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget, QScrollArea
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal, pyqtSlot
 
 DEFAULT_PDF_PATH = '/home/josh/Code/Tabify/output_file.pdf'
+PIXMAP_CACHE_BYTES = 256 * 2**20
+# pages within this many screen heights of the visible area are rendered before they scroll into view
+PREFETCH_SCREENS = 1
+
+class PixmapCache:
+    '''
+    A least-recently-used cache of rendered pages, keyed by page number and zoom level.
+    max_bytes: the total size of the pixmaps to keep
+    '''
+    def __init__(self, max_bytes = PIXMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pixmaps = OrderedDict()
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, page, zoom):
+        key = (page, zoom)
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, page, zoom, pixmap):
+        key = (page, zoom)
+        if key in self.pixmaps:
+            self.size -= self.pixmap_bytes(self.pixmaps.pop(key))
+        self.pixmaps[key] = pixmap
+        self.size += self.pixmap_bytes(pixmap)
+
+        # the newest page is always kept, even if it's bigger than the whole cache
+        while self.size > self.max_bytes and len(self.pixmaps) > 1:
+            _, old_pixmap = self.pixmaps.popitem(last = False)
+            self.size -= self.pixmap_bytes(old_pixmap)
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.size = 0
+
+class PageRenderer(QObject):
+    '''
+    Rasterizes pages of a PDF in the thread it's moved to, with its own handle on the document. Each
+    request replaces the pages still waiting from the last one, so scrolling quickly past a page
+    never renders it.
+    rendered: emitted with the document generation, page number, zoom and image of each page
+    '''
+    rendered = pyqtSignal(int, int, float, QImage)
+    wake = pyqtSignal()
+
+    def __init__(self):
+        super(PageRenderer, self).__init__()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pdf_path = None
+        self.generation = None
+        self.doc = None
+        self.doc_generation = None
+        # emitted from the GUI thread, so process() is queued in the renderer's thread
+        self.wake.connect(self.process)
+
+    def request(self, pdf_path, generation, pages, zoom):
+        '''
+        Sets the pages to render, most wanted first. Safe to call from any thread.
+        generation: changes whenever a different document is loaded
+        '''
+        with self.lock:
+            self.pdf_path = pdf_path
+            self.generation = generation
+            self.pending = [(page, zoom) for page in pages]
+        self.wake.emit()
+
+    @pyqtSlot()
+    def process(self):
+        with self.lock:
+            if not self.pending:
+                return
+            page, zoom = self.pending.pop(0)
+            pdf_path, generation = self.pdf_path, self.generation
+
+        if self.doc_generation != generation:
+            self.close()
+            self.doc = fitz.open(pdf_path)
+            self.doc_generation = generation
+
+        pix = self.doc.load_page(page).get_pixmap(matrix = fitz.Matrix(zoom, zoom), alpha = False)
+        image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
+        # copy the data out of the fitz pixmap before it's freed
+        self.rendered.emit(generation, page, zoom, image.copy())
+
+        # let newer requests in before the next page
+        QTimer.singleShot(0, self.process)
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+            self.doc_generation = None
 
 class ScoreViewer(QWidget):
     '''
-    
+    A scrolling view of the pages of a PDF. Every page has a placeholder of the right size from the
+    start, and is only rendered once it comes near the screen.
+    zoom: the scale the pages are drawn at, where 1 is 72 dpi
     '''
     def __init__(self, pdf_path = DEFAULT_PDF_PATH, parent = None):
         super(ScoreViewer, self).__init__(parent)
@@ -24,6 +128,30 @@ class ScoreViewer(QWidget):
         layout.addWidget(self.scroll_area)
         self.setLayout(layout)
 
+        self.pdf_path = None
+        self.generation = 0
+        self.zoom = 1.0
+        self.page_sizes = []
+        self.pages = []
+        self.shown = set()
+        self.cache = PixmapCache()
+
+        self.render_thread = QThread(self)
+        self.renderer = PageRenderer()
+        self.renderer.moveToThread(self.render_thread)
+        self.renderer.rendered.connect(self.page_rendered)
+        self.render_thread.start()
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stop_rendering)
+
+        # the page positions aren't known until the layout has run, so updates wait for the event loop
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(0)
+        self.update_timer.timeout.connect(self.update_visible_pages)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.schedule_update)
+
         if pdf_path is not None:
             self.load_pdf(pdf_path)
         else:
@@ -31,31 +159,123 @@ class ScoreViewer(QWidget):
 
     def load_pdf(self, pdf_path):
         '''
-        
+        Lays out a blank placeholder for each page, sized from the page dimensions, without
+        rendering anything.
         '''
-        doc = fitz.open(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            self.page_sizes = [(page.rect.width, page.rect.height) for page in doc]
+        self.pdf_path = pdf_path
+        self.generation += 1
+        self.cache.clear()
+        self.shown.clear()
 
         content_widget = QWidget()
         content_layout = QVBoxLayout()
 
-        for i in range(len(doc)):
-            page = doc.load_page(i)
-            pix = page.get_pixmap(alpha=False)
-
-            qtimg = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-            qtimg.bits()  # enforce a copy of the data
-
+        self.pages = []
+        for _ in self.page_sizes:
             label = QLabel()
-            label.setPixmap(QPixmap.fromImage(qtimg))
-            label.setAlignment(Qt.AlignHCenter)
-            content_layout.addWidget(label)
+            label.setStyleSheet('background-color: white')
+            content_layout.addWidget(label, 0, Qt.AlignHCenter)
+            self.pages.append(label)
 
         content_widget.setLayout(content_layout)
         self.scroll_area.setWidget(content_widget)
+        self.set_zoom(self.zoom)
+
+    def set_zoom(self, zoom):
+        '''
+        Resizes the placeholders and renders the pages in view at the new scale. Pages already
+        rendered at other scales stay in the cache for switching back.
+        '''
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        position = scroll_bar.value() / self.zoom
+        self.zoom = zoom
+        for label, (width, height) in zip(self.pages, self.page_sizes):
+            label.clear()
+            label.setFixedSize(round(width * zoom), round(height * zoom))
+        self.shown.clear()
+
+        # lay the pages out again now rather than in the next event loop pass, so the view can stay
+        # on the same part of the score
+        content_widget = self.scroll_area.widget()
+        if content_widget is not None:
+            content_widget.layout().activate()
+            content_widget.adjustSize()
+        scroll_bar.setValue(round(position * zoom))
+        self.schedule_update()
+
+    def schedule_update(self, *_):
+        '''
+        Updates the visible pages once the event loop has caught up, combining repeated calls.
+        '''
+        self.update_timer.start()
+
+    def is_near_view(self, label):
+        '''
+        Returns: whether the page is visible or within PREFETCH_SCREENS of the visible area
+        '''
+        viewport_height = self.scroll_area.viewport().height()
+        top = self.scroll_area.verticalScrollBar().value() - PREFETCH_SCREENS * viewport_height
+        bottom = top + (1 + 2 * PREFETCH_SCREENS) * viewport_height
+        return label.y() < bottom and label.y() + label.height() > top
+
+    @pyqtSlot()
+    def update_visible_pages(self):
+        '''
+        Shows the cached pages near the view, asks for the rest to be rendered (nearest the middle
+        of the screen first) and clears the pages that have scrolled out of range.
+        '''
+        if self.pdf_path is None:
+            return
+
+        middle = (self.scroll_area.verticalScrollBar().value() +
+                  self.scroll_area.viewport().height() / 2)
+        wanted = []
+        for i, label in enumerate(self.pages):
+            if not self.is_near_view(label):
+                if i in self.shown:
+                    label.clear()
+                    self.shown.discard(i)
+                continue
+            if i in self.shown:
+                continue
+
+            pixmap = self.cache.get(i, self.zoom)
+            if pixmap is not None:
+                label.setPixmap(pixmap)
+                self.shown.add(i)
+            else:
+                wanted.append(i)
+
+        wanted.sort(key = lambda i: abs(self.pages[i].y() + self.pages[i].height() / 2 - middle))
+        self.renderer.request(self.pdf_path, self.generation, wanted, self.zoom)
+
+    @pyqtSlot(int, int, float, QImage)
+    def page_rendered(self, generation, page, zoom, image):
+        if generation != self.generation:
+            return
+        pixmap = QPixmap.fromImage(image)
+        self.cache.put(page, zoom, pixmap)
+
+        label = self.pages[page]
+        if zoom == self.zoom and self.is_near_view(label):
+            label.setPixmap(pixmap)
+            self.shown.add(page)
+
+    def resizeEvent(self, event): # pylint: disable=invalid-name
+        super(ScoreViewer, self).resizeEvent(event)
+        self.schedule_update()
+
+    @pyqtSlot()
+    def stop_rendering(self):
+        self.render_thread.quit()
+        self.render_thread.wait()
+        self.renderer.close()
 
     def display_splash(self):
         '''
-        
+
         '''
         # todo: show a blank window with text prompting the user to choose a file in the control
         # center
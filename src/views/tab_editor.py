@@ -2,17 +2,27 @@
 Defines the TabEditor class, a specialized text input that is optimized
 for letting users edit guitar tablature.
 '''
-from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtWidgets import QWidget, QLineEdit
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import (QComboBox, QHBoxLayout, QLineEdit, QPushButton, QSpinBox, QVBoxLayout,
+                             QWidget)
 from Tabify.src.models.tab import Tab
 
 class TabEditor(QWidget):
     '''
     
+    candidates: the viable fingerings of each chord of the tab, which the user can pin one of
+    fingeringPinned: emitted with the chord index and fingering index when the user fixes the
+    fingering of a chord
     '''
+    fingeringPinned = pyqtSignal(int, int)
+
     def __init__(self, tab = None, parent = None):
         super(TabEditor, self).__init__(parent)
         self.tab = tab
+        self.editor = None
+        self.candidates = []
+        self.vbox = QVBoxLayout(self)
+        self.setupPinControls()
         if tab is not None:
             self.setupInterface()
         else:
@@ -22,7 +32,26 @@ class TabEditor(QWidget):
         # todo: print each line of the tab. there should be some interplay between
         # QLabels and QTextEdits. Maybe this is a separate widget class for each line?
         self.editor = QLineEdit()
-        self.editor.setText(str(self.tab))
+        self.editor.setText('' if self.tab is None else str(self.tab))
+        self.vbox.insertWidget(0, self.editor)
+
+    def setupPinControls(self):
+        '''
+        Sets up a row for forcing the fingering of a chord: the number of the chord, a choice of its
+        candidate fingerings, and a button to pin the chosen one.
+        '''
+        self.chord_picker = QSpinBox()
+        self.fingering_picker = QComboBox()
+        self.pin_button = QPushButton('Pin')
+        self.chord_picker.valueChanged.connect(self.listCandidates)
+        self.pin_button.clicked.connect(self.pinSelected)
+
+        row = QHBoxLayout()
+        row.addWidget(self.chord_picker)
+        row.addWidget(self.fingering_picker)
+        row.addWidget(self.pin_button)
+        self.vbox.addLayout(row)
+        self.setCandidates([])
 
     def displaySplash(self):
         # todo: show a blank screen with text prompting the user to transcribe a file in the control
@@ -32,7 +61,61 @@ class TabEditor(QWidget):
     @pyqtSlot(Tab)
     def changeTab(self, new_tab):
         self.tab = new_tab
-        self.editor.setText(str(self.tab))
+        if self.editor is None:
+            self.setupInterface()
+        else:
+            self.editor.setText(str(self.tab))
+
+    @pyqtSlot()
+    def clearTab(self):
+        '''
+        Empties the editor for the lines of a transcription that's starting.
+        '''
+        self.tab = None
+        if self.editor is not None:
+            self.editor.clear()
+
+    @pyqtSlot(object)
+    def appendLines(self, lines):
+        '''
+        Adds lines of tab to the end of the editor while a transcription is still running, without
+        rendering what's already there again.
+        '''
+        if self.editor is None:
+            self.setupInterface()
+        self.editor.end(False)
+        self.editor.insert(''.join(line + '\n' for line in lines))
+
+    @pyqtSlot(object)
+    def setCandidates(self, candidates):
+        '''
+        candidates: a list of the viable fingerings of each chord of the tab, or an empty list while
+        there's nothing to pin
+        '''
+        self.candidates = candidates
+        self.chord_picker.setRange(1, max(1, len(candidates)))
+        self.pin_button.setEnabled(bool(candidates))
+        self.listCandidates(self.chord_picker.value())
+
+    @pyqtSlot(int)
+    def listCandidates(self, chord_number):
+        '''
+        Fills the fingering choice with the candidates of a chord, lowest string first.
+        '''
+        self.fingering_picker.clear()
+        if self.tab is None or chord_number > len(self.candidates):
+            return
+        self.fingering_picker.addItems([' '.join(reversed(self.tab.column(fingering)))
+                                        for fingering in self.candidates[chord_number - 1]])
+
+    @pyqtSlot()
+    def pinSelected(self):
+        fingering_index = self.fingering_picker.currentIndex()
+        if fingering_index >= 0:
+            self.pinFingering(self.chord_picker.value() - 1, fingering_index)
+
+    def pinFingering(self, chord_index, fingering_index):
+        self.fingeringPinned.emit(chord_index, fingering_index)
 
     def save(self):
         # todo: does the save button need to be its own widget?
@@ -0,0 +1,100 @@
+'''
+Defines the TranscriptionWorker class, which runs a transcription in a background thread and reports
+its progress and the tab so far as it goes.
+'''
+import time
+from PyQt5.QtCore import QThread, pyqtSignal
+from Tabify.src.models.tab import Tab
+from Tabify.src.models.transcriber import Transcriber, OPTIMIZE_STAGE
+
+# the least time between progress reports, and between partial tabs, in seconds
+PROGRESS_INTERVAL = 0.05
+PARTIAL_INTERVAL = 0.5
+
+class TranscriptionCancelled(Exception):
+    '''
+    Raised inside the worker thread to unwind a transcription that has been cancelled.
+    '''
+
+class TranscriptionWorker(QThread):
+    '''
+    Transcribes a file with the streaming optimizer, so the start of the tab can be shown while the
+    rest is worked out, and then finishes with the exact search, whose costs are kept for pinning
+    fingerings afterwards. Each worker has its own Transcriber, so a cancelled one can be left to
+    stop by itself at its next progress report while the next one starts; it emits nothing more.
+    transcriber: the Transcriber the worker uses, which is free to use once it has finished
+    progress: emitted with the stage name, the chords done and the total number of chords
+    partial: emitted with the lines of tab finished since the last partial update; only the lines
+    are sent, so each update costs the same however long the tab gets
+    transcribed: emitted with the finished tab
+    failed: emitted with a description of the error
+    '''
+    progress = pyqtSignal(str, int, int)
+    partial = pyqtSignal(object)
+    transcribed = pyqtSignal(Tab)
+    failed = pyqtSignal(str)
+
+    def __init__(self, configs, input_file, parent = None):
+        super(TranscriptionWorker, self).__init__(parent)
+        self.transcriber = Transcriber(configs)
+        self.input_file = input_file
+        self.cancelled = False
+        self.last_progress = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report_progress(self, stage_name, done, total):
+        '''
+        The progress callback given to the Transcriber; it's also where cancellation is noticed.
+        '''
+        if self.cancelled:
+            raise TranscriptionCancelled()
+        now = time.perf_counter()
+        if done == total or now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.progress.emit(stage_name, done, total)
+
+    def run(self):
+        try:
+            tab = self.transcribe()
+        except TranscriptionCancelled:
+            return
+        except Exception as e: # pylint: disable=broad-except
+            if not self.cancelled:
+                self.failed.emit(repr(e))
+            return
+        finally:
+            # the fingering cache's connection belongs to this thread
+            self.transcriber.close()
+        if not self.cancelled:
+            self.transcribed.emit(tab)
+
+    def transcribe(self):
+        transcriber = self.transcriber
+        events = transcriber.read_score(self.input_file, self.report_progress)
+        if not len(events):
+            return Tab([], transcriber.configs.guitar)
+        transcriber.song = transcriber.prepare_song(events, self.report_progress)
+        offsets = transcriber.song.chord_offsets.tolist()
+
+        def make_tab(fingerings):
+            return Tab(fingerings, transcriber.configs.guitar, offsets = offsets,
+                       measure_length = transcriber.configs.measure_length)
+
+        lines = []
+        last_partial = time.perf_counter()
+        for line in make_tab(transcriber.evaluate_song_online(self.report_progress)).lines():
+            lines.append(line)
+            now = time.perf_counter()
+            if now - last_partial >= PARTIAL_INTERVAL:
+                last_partial = now
+                self.partial.emit(lines)
+                lines = []
+
+        # the exact search and the backward pass are what solve_pinned works from, so doing them
+        # here keeps the first pin off the GUI thread, and the finished tab is the one pins change
+        path = transcriber.evaluate_song()
+        self.report_progress(OPTIMIZE_STAGE, len(path), len(path))
+        transcriber.optimizer.backward()
+        return make_tab(path)